@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# Joins the English and Chinese editions of each question bank, so that every English question is paired with its
+# Chinese translation. Writes the result as bilingual YAML files and/or an Anki package of bilingual cards.
+#
+# Each input is a PDF (named as in QuestionFile.FILEMAP) or a YAML file (named after its file ID, like
+# english-car-rules-true.yaml), or a directory containing those. PDFs are parsed in parallel, one worker process per PDF.
+# English YAMLs from yamls/ are usually the better input for the English side, since they carry difficulty ratings.
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import sys
+import tempfile
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from extraction_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from generate_anki_from_yaml import get_bilingual_model, get_tags_for_yaml, render_bilingual_fields
+from generate_yaml_from_pdf import QuestionFile, cache_from_args, copy_images_to_output_dir_and_update_paths, parse_pdf
+from question import Question, dump_yaml
+
+if TYPE_CHECKING:
+  import genanki
+
+parser = argparse.ArgumentParser(description='Pair the questions of the English and Chinese question banks')
+parser.add_argument('--inputs', nargs='+', required=True,
+                    help='PDF or YAML files of both editions, or directories containing them')
+parser.add_argument('--output-yaml-dir', help='Directory to write bilingual-<vehicle>-<kind>-<format>.yaml files to')
+parser.add_argument('--output-apkg', help='Path to write an Anki package of bilingual cards to')
+parser.add_argument('--output-image-dir', default='images',
+                    help='Directory to write the images of the signs PDFs to. Images are named after their hash, so '
+                         'images that are the same in both editions get the same name.')
+parser.add_argument('--jobs', type=int, help='Number of worker processes (default: number of CPUs)')
+parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory to cache pdftohtml output and parsed questions in')
+parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                    help='Evict least-recently-used cache entries once the cache is bigger than this')
+parser.add_argument('--no-cache', action='store_true', help="Don't read or write the extraction cache")
+
+# Keys that an English question and its translation are joined on, from the strictest to the loosest. The answer is
+# part of every key, since a translation always has the same answer. A key of None means the key doesn't apply. Joining
+# on the image alone pairs signs questions that are numbered differently in the two editions, and joining on the number
+# alone pairs signs whose images were rendered slightly differently.
+JOIN_KEYS = [
+  ('number and image',
+   lambda quest: (quest.answer, quest.number, quest.category, quest.question_image) if quest.question_image else None),
+  ('image', lambda quest: (quest.answer, quest.category, quest.question_image) if quest.question_image else None),
+  ('number', lambda quest: (quest.answer, quest.number, quest.category)),
+]
+
+# Keys that only say the two questions are in the same place in their banks. If one edition was renumbered, or had a
+# question added or removed, the questions at a number are unrelated, and their answers and categories agree by
+# chance about half the time. So pairs joined on these keys are only kept if the 8 questions on either side of them
+# agree too, which an unrelated stretch of a true or false bank does well under once in ten thousand times.
+POSITIONAL_KEYS = frozenset(['number'])
+NEIGHBOR_OFFSETS = [offset for offset in range(-8, 9) if offset]
+
+
+def expand_inputs(inputs: List[str]) -> List[str]:
+  ret = []
+  for path in inputs:
+    if os.path.isdir(path):
+      ret.extend(sorted(glob.glob(os.path.join(path, '*.pdf')) + glob.glob(os.path.join(path, '*.yaml'))))
+    else:
+      ret.append(path)
+  return ret
+
+
+def load_bank(path: str, output_image_dir: str, cache) -> Tuple[str, List[Question]]:
+  """Return the file ID (like 'english-car-rules-true') and the questions of the PDF or YAML file at `path`."""
+  base, ext = os.path.splitext(os.path.basename(path))
+  if ext == '.yaml':
+    return base, Question.load_list_from_yaml(path)
+
+  has_images = QuestionFile(filebase=base).signsrules == 'signs'
+  with tempfile.TemporaryDirectory() as work_dir:
+    qfile = parse_pdf(path, has_images=has_images, cache=cache, work_dir=work_dir)
+    if has_images:
+      copy_images_to_output_dir_and_update_paths(qfile.questions, output_image_dir)
+  return qfile.getFileID(), qfile.questions
+
+
+def load_banks(paths: List[str], output_image_dir: str, cache, jobs: Optional[int]) -> Dict[str, List[Question]]:
+  """Load every file in `paths` in parallel, and return a dict mapping each file ID to its questions."""
+  ret = {}
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+    futures = {executor.submit(load_bank, path, output_image_dir, cache): path for path in paths}
+    for future in concurrent.futures.as_completed(futures):
+      file_id, questions = future.result()
+      if file_id in ret:
+        raise RuntimeError(f'Got the {file_id} bank twice (the second time from {futures[future]})')
+      ret[file_id] = questions
+  return ret
+
+
+def _neighbors_agree(en_by_number: Dict[int, Question], zh_by_number: Dict[int, Question], number) -> bool:
+  """Whether the questions numbered near `number` have the same answers and categories in both editions."""
+  if not isinstance(number, int):
+    return True
+  for offset in NEIGHBOR_OFFSETS:
+    en_quest = en_by_number.get(number + offset)
+    zh_quest = zh_by_number.get(number + offset)
+    if en_quest and zh_quest and (en_quest.answer, en_quest.category) != (zh_quest.answer, zh_quest.category):
+      return False
+  return True
+
+
+def align_questions(en: List[Question], zh: List[Question]):
+  """
+  Pair each question in `en` with its translation in `zh`.
+
+  Returns a (pairs, unmatched_zh, counts, rejected) tuple, where pairs has an (English question, Chinese question or
+  None) tuple for each question in `en`, in order, unmatched_zh lists the questions in `zh` that weren't paired, counts
+  maps each JOIN_KEYS name to the number of questions paired by it, and rejected lists the (English question, Chinese
+  question) pairs that a POSITIONAL_KEYS key matched but whose neighbors disagree (see _neighbors_agree).
+
+  Each key gets a hash index over `zh`, so this takes time linear in the number of questions. Every question is first
+  joined on the strictest key, and only questions that are still unpaired are tried on the next one, so a loose key
+  can't take a translation away from the question it belongs to. A key that matches several unpaired questions is
+  ambiguous and doesn't pair anything.
+  """
+  matches: List[Optional[int]] = [None] * len(en)
+  taken = [False] * len(zh)
+  counts = {}
+  rejected = []
+  en_by_number = {quest.number: quest for quest in en}
+  zh_by_number = {quest.number: quest for quest in zh}
+
+  for name, key_fn in JOIN_KEYS:
+    index: Dict[tuple, List[int]] = {}
+    for j, quest in enumerate(zh):
+      key = key_fn(quest)
+      if key is not None and not taken[j]:
+        index.setdefault(key, []).append(j)
+
+    counts[name] = 0
+    for i, quest in enumerate(en):
+      if matches[i] is not None:
+        continue
+      key = key_fn(quest)
+      candidates = [j for j in index.get(key, ()) if not taken[j]] if key is not None else []
+      if len(candidates) == 1:
+        if name in POSITIONAL_KEYS and not _neighbors_agree(en_by_number, zh_by_number, quest.number):
+          rejected.append((quest, zh[candidates[0]]))
+          continue
+        matches[i] = candidates[0]
+        taken[candidates[0]] = True
+        counts[name] += 1
+
+  pairs = [(quest, zh[j] if j is not None else None) for quest, j in zip(en, matches)]
+  unmatched_zh = [quest for quest, is_taken in zip(zh, taken) if not is_taken]
+  return pairs, unmatched_zh, counts, rejected
+
+
+def bilingual_entries(pairs: List[Tuple[Question, Optional[Question]]]) -> List[dict]:
+  """
+  Return the YAML entries for `pairs`: the English question's fields, plus question_zh (and number_zh, if the Chinese
+  edition numbers the question differently).
+  """
+  ret = []
+  for en, zh in pairs:
+    entry = {}
+    for name, value in en.to_dict().items():
+      entry[name] = value
+      if name == 'question' and zh:
+        entry['question_zh'] = zh.question
+    if zh and zh.number != en.number:
+      entry['number_zh'] = zh.number
+    ret.append(entry)
+  return ret
+
+
+def build_bilingual_package(entries_by_yaml: Dict[str, List[dict]], input_image_dir: str) -> 'genanki.Package':
+  """
+  Build a package of bilingual notes, tagged like the notes built by generate_anki_from_yaml.py. The keys of
+  `entries_by_yaml` are the names of the bilingual YAML files, which determine the tags.
+  """
+  import genanki
+
+  # Like build_package, make a single note for a question that appears in several banks, with the tags of all of them.
+  unique_questions: Dict[Tuple[str, str, str, str], Tuple[Optional[str], Dict[str, None]]] = {}
+  for yaml_name, entries in entries_by_yaml.items():
+    yaml_tags = get_tags_for_yaml(yaml_name)
+    for entry in entries:
+      question = Question(question=entry['question'], question_image=entry.get('question_image'),
+                          answer=str(entry['answer']), difficulty=entry['difficulty'])
+      fields = (*render_bilingual_fields(question, entry.get('question_zh', '')), question.answer)
+      unique = unique_questions.get(fields)
+      if unique is None:
+        unique = unique_questions[fields] = (question.question_image, {question.difficulty: None})
+      unique[1].update(dict.fromkeys(yaml_tags))
+
+  deck = genanki.Deck(
+    1395868282,
+    "Taiwan Driver's License Written Test (English and Chinese)")
+  media_files = {}
+  for fields, (image, tags) in unique_questions.items():
+    if image:
+      media_files[os.path.join(input_image_dir, image)] = None
+    deck.add_note(genanki.Note(model=get_bilingual_model(), fields=list(fields), tags=list(tags),
+                               guid=genanki.guid_for(*fields)))
+
+  package = genanki.Package(deck)
+  package.media_files = list(media_files)
+  return package
+
+
+def main(args):
+  if not args.output_yaml_dir and not args.output_apkg:
+    parser.error('at least one of --output-yaml-dir and --output-apkg is required')
+
+  os.makedirs(args.output_image_dir, exist_ok=True)
+  banks = load_banks(expand_inputs(args.inputs), args.output_image_dir, cache_from_args(args), args.jobs)
+
+  entries_by_yaml = {}
+  for file_id in sorted(banks):
+    language, bank = file_id.split('-', 1)
+    if language != 'english':
+      continue
+    if f'chinese-{bank}' not in banks:
+      print(f'{bank}: no Chinese edition given, skipping', file=sys.stderr)
+      continue
+
+    pairs, unmatched_zh, counts, rejected = align_questions(banks[file_id], banks[f'chinese-{bank}'])
+    unmatched_en = sum(1 for _, zh in pairs if zh is None)
+    by_key = ', '.join(f'{count} by {name}' for name, count in counts.items())
+    print(f'{bank}: paired {len(pairs) - unmatched_en} of {len(pairs)} questions ({by_key}); '
+          f'{unmatched_en} English and {len(unmatched_zh)} Chinese questions unpaired')
+    if rejected:
+      numbers = ', '.join(str(en_quest.number) for en_quest, _ in rejected)
+      print(f'{bank}: WARNING: not pairing {len(rejected)} questions by number, because the questions around them '
+            f"don't match (was one edition renumbered?): {numbers}", file=sys.stderr)
+    entries_by_yaml[f'bilingual-{bank}.yaml'] = bilingual_entries(pairs)
+
+  if args.output_yaml_dir:
+    os.makedirs(args.output_yaml_dir, exist_ok=True)
+    for yaml_name, entries in entries_by_yaml.items():
+      with open(os.path.join(args.output_yaml_dir, yaml_name), 'w', encoding='utf-8') as f:
+        dump_yaml(entries, f, allow_unicode=True)
+
+  if args.output_apkg:
+    build_bilingual_package(entries_by_yaml, args.output_image_dir).write_to_file(args.output_apkg)
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
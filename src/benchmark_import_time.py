@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Measures how long the extraction and packaging scripts take to start, using python -X importtime, and checks that
+# they don't import their heavy dependencies (lxml, natsort, genanki, yaml, Pillow) at module load time. Exits with
+# status 1 if a heavy dependency is imported or a script takes longer than --max-ms to import, so it can be used to
+# catch startup regressions.
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, Tuple
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODULES = ['generate_yaml_from_pdf', 'generate_anki_from_yaml']
+HEAVY_MODULES = ['lxml', 'natsort', 'genanki', 'yaml', 'PIL']
+
+parser = argparse.ArgumentParser(description='Measure the import time of the build scripts')
+parser.add_argument('--modules', nargs='+', default=MODULES, help='Modules in src/ to measure')
+parser.add_argument('--runs', type=int, default=5, help='Number of runs per module; the fastest one is reported')
+parser.add_argument('--top', type=int, default=5, help='Number of slowest imports to list per module')
+parser.add_argument('--max-ms', type=float, help='Fail if importing any module takes longer than this')
+
+
+def _env() -> Dict[str, str]:
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join(filter(None, [SRC_DIR, env.get('PYTHONPATH')]))
+  return env
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int, int]]:
+  """
+  Import `module` in a fresh interpreter and return a dict mapping each imported module to its (self, cumulative)
+  import time in microseconds and its nesting depth (0 for `module` itself, 1 for the modules it imports, and so on).
+  """
+  proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], env=_env(),
+                        stderr=subprocess.PIPE, text=True, check=True)
+
+  ret = {}
+  for line in proc.stderr.splitlines():
+    # Lines look like "import time:       482 |       7145 |     concurrent.futures._base".
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    self_us, cumulative_us, name = line[len('import time:'):].split('|')
+    depth = (len(name) - len(name.lstrip()) - 1) // 2
+    ret[name.strip()] = (int(self_us), int(cumulative_us), depth)
+  return ret
+
+
+def help_time(module: str) -> float:
+  """Return the wall time in seconds of running `module --help`."""
+  start = time.perf_counter()
+  subprocess.run([sys.executable, os.path.join(SRC_DIR, module + '.py'), '--help'], env=_env(),
+                 stdout=subprocess.DEVNULL, check=True)
+  return time.perf_counter() - start
+
+
+def main(args):
+  failed = False
+  for module in args.modules:
+    runs = [import_times(module) for _ in range(args.runs)]
+    times = min(runs, key=lambda times: times[module][1])
+    total_ms = times[module][1] / 1000
+    help_ms = min(help_time(module) for _ in range(args.runs)) * 1000
+
+    print(f'{module}: {total_ms:.1f} ms to import, {help_ms:.1f} ms for --help')
+    direct = [(cumulative_us, name) for name, (_, cumulative_us, depth) in times.items() if depth == 1]
+    for cumulative_us, name in sorted(direct, reverse=True)[:args.top]:
+      print(f'  {cumulative_us / 1000:7.1f} ms  {name}')
+
+    heavy = [name for name in HEAVY_MODULES if name in times]
+    if heavy:
+      print(f'  ERROR: imports {", ".join(heavy)} at load time')
+      failed = True
+    if args.max_ms is not None and total_ms > args.max_ms:
+      print(f'  ERROR: import takes longer than {args.max_ms} ms')
+      failed = True
+
+  if failed:
+    sys.exit(1)
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Micro-benchmark for the text classification loop in parse_pdf. Runs pdftohtml over each PDF once, then times the
+# state machine over the collected text nodes, using both the original per-pattern implementation and the precompiled
+# classifier.
+
+import argparse
+import contextlib
+import glob
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+
+import generate_yaml_from_pdf
+from generate_yaml_from_pdf import QuestionFile, iter_pdf_text_nodes, parse_text_nodes, pdftohtml_options
+
+parser = argparse.ArgumentParser(description='Report text nodes per second for the parse_pdf classification loop')
+parser.add_argument('--pdfs', nargs='+', help='PDFs to benchmark (default: every PDF in pdfs/)')
+parser.add_argument('--repeat', type=int, default=20, help='Number of times to run the loop over each PDF')
+
+
+def warning(*objs):
+  print("WARNING: ", *objs, file=sys.stderr)
+
+
+def legacy_parse_text_nodes(qfile: QuestionFile, text_nodes) -> None:
+  # The classification loop as it was before IGNORABLE_LINE_RE and TEXT_KIND_RE were introduced.
+  current_q = qfile.newQuestion()
+
+  state = ''
+  qnum = 0
+
+  ignorable_lines = ['^' + pattern + '$' for pattern in generate_yaml_from_pdf.IGNORABLE_LINES]
+
+  for page, top_pos, left_pos, txt in text_nodes:
+    txt_strip = txt.strip()
+    txt_nospace = re.sub(r'\s+', '', txt)
+    if not txt_strip:
+      continue
+    skip = False
+    for ignore in ignorable_lines:
+      if re.match(ignore, txt_nospace):
+        skip = True
+        continue
+    if skip:
+      continue
+    if re.match('^[0-9]{3}$', txt_strip):
+      state = 'found_qnum'
+      qnum = int(txt_strip)
+      if current_q:
+        current_q.question = re.sub('\n', '', current_q.question)
+        current_q = qfile.newQuestion()
+      current_q.number = qnum
+      continue
+    elif state == 'found_qnum':
+      if re.match('^[0-9OX]$', txt_strip) or txt_strip == 'Ｘ' or txt_strip == 'Ｏ':
+        state = 'found_ans'
+        if current_q.answer != '':
+          warning("%d: Answer being overwritten" % (qnum))
+        if txt_strip == 'Ｏ': txt_strip = 'O'
+        elif txt_strip == 'Ｘ': txt_strip = 'X'
+        current_q.answer = txt_strip
+      else:
+        warning("%d: Answer not found after question number" % (qnum))
+    elif state == 'found_ans' and not re.match('^[0-9]+$', txt_strip):
+      current_q.question += txt
+    elif re.match('^[0-9]{1,2}$', txt_strip) and left_pos > 0.75:
+      current_q.category = txt_strip
+
+
+def time_loop(loop_fn, filebase: str, text_nodes, repeat: int):
+  start = time.perf_counter()
+  with contextlib.redirect_stderr(io.StringIO()):
+    for _ in range(repeat):
+      qfile = QuestionFile(filebase=filebase)
+      loop_fn(qfile, text_nodes)
+  return time.perf_counter() - start, qfile.questions
+
+
+def main(args):
+  pdfs = args.pdfs or sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'pdfs', '*.pdf')))
+
+  total_nodes = 0
+  total_before = 0.0
+  total_after = 0.0
+  for path_to_pdf in pdfs:
+    filebase = os.path.splitext(os.path.basename(path_to_pdf))[0]
+    with tempfile.TemporaryDirectory() as tempdir:
+      text_nodes = list(iter_pdf_text_nodes(
+        path_to_pdf, os.path.join(tempdir, filebase + '.xml'), options=pdftohtml_options(has_images=False)))
+
+    before, before_questions = time_loop(legacy_parse_text_nodes, filebase, text_nodes, args.repeat)
+    after, after_questions = time_loop(parse_text_nodes, filebase, text_nodes, args.repeat)
+
+    if before_questions != after_questions:
+      raise RuntimeError(f'Classifier output differs from the original loop for {path_to_pdf}')
+
+    nodes = len(text_nodes) * args.repeat
+    total_nodes += nodes
+    total_before += before
+    total_after += after
+    print(f'{filebase}: {len(text_nodes)} text nodes, '
+          f'before {nodes / before:,.0f} nodes/s, after {nodes / after:,.0f} nodes/s')
+
+  print(f'total: before {total_nodes / total_before:,.0f} nodes/s, after {total_nodes / total_after:,.0f} nodes/s, '
+        f'speedup {total_before / total_after:.2f}x')
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
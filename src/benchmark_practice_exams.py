@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Reports how many practice exams per second generate_practice_exams.ExamSampler can draw from the question banks in
+# yamls/, after its one-time indexing. Also checks that every question in the bank is drawn by at least one of the exams,
+# and exits with status 1 if some never are.
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+from generate_practice_exams import STRATA, ExamSampler, load_bank
+
+parser = argparse.ArgumentParser(description='Benchmark practice exam sampling')
+parser.add_argument('--yamls', nargs='+', help='YAML files to sample from (default: every file in yamls/)')
+parser.add_argument('--num-questions', type=int, default=40, help='Number of questions in each exam')
+parser.add_argument('--num-exams', type=int, default=10000, help='Number of exams to draw')
+
+
+def main(args):
+  yaml_paths = args.yamls or sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'yamls', '*.yaml')))
+  bank = load_bank(yaml_paths)
+
+  start = time.perf_counter()
+  sampler = ExamSampler(bank, STRATA)
+  sampler.allocation(args.num_questions)
+  index_time = time.perf_counter() - start
+
+  start = time.perf_counter()
+  for seed in range(args.num_exams):
+    sampler.sample(args.num_questions, seed)
+  sample_time = time.perf_counter() - start
+
+  print(f'{len(bank)} questions in {len(sampler.allocation(args.num_questions))} strata, '
+        f'indexed in {index_time * 1000:.1f} ms')
+  print(f'{args.num_exams} exams of {args.num_questions} questions in {sample_time:.2f} s '
+        f'({args.num_exams / sample_time:,.0f} exams/s)')
+
+  drawn = set()
+  for seed in range(args.num_exams):
+    drawn.update(id(quest) for quest in sampler.sample(args.num_questions, seed))
+  never_drawn = [quest for quest, _ in bank if id(quest) not in drawn]
+  print(f'{len(drawn)} distinct questions drawn, {len(never_drawn)} never drawn')
+  if never_drawn:
+    for quest in never_drawn[:10]:
+      print(f'  never drawn: {quest.number} {quest.question[:60]!r}')
+    sys.exit(1)
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Measures the memory used by Question objects, compared with the __dict__-based Question class this repo used to
+# have. The field values are drawn from a small shared pool, so the numbers are the per-object overhead.
+
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+
+from question import Question
+
+parser = argparse.ArgumentParser(description='Benchmark memory use of Question objects')
+parser.add_argument('--count', type=int, default=1000000, help='Number of synthetic questions to create')
+
+
+class DictQuestion(object):
+  """Question as it was before it had __slots__, for comparison."""
+  UNKNOWN_DIFFICULTY = 'unknown_difficulty'
+
+  def __init__(self, question='', question_image=None, answer='', number='', category='', difficulty=UNKNOWN_DIFFICULTY, note=''):
+    self.question = question
+    self.question_image = question_image
+    self.answer = answer
+    self.number = number
+    self.category = category
+    self.difficulty = difficulty
+    self.note = note
+
+  def __eq__(self, other):
+    return self.__class__ is other.__class__ and self.__dict__ == other.__dict__
+
+  def __ne__(self, other):
+    return not (self == other)
+
+  def __bool__(self):
+    empty = DictQuestion()
+    return self != empty
+
+
+def make_questions(cls, count: int, seed: int = 0) -> list:
+  rng = random.Random(seed)
+  texts = [f'Synthetic question {i} (1) a (2) b (3) c' for i in range(1000)]
+  categories = [f'{i:02}' for i in range(1, 13)]
+  difficulties = ['easy', 'medium', 'hard', Question.UNKNOWN_DIFFICULTY]
+  return [
+    cls(question=rng.choice(texts), answer=rng.choice('123'), number=i % 1000 + 1,
+        category=rng.choice(categories), difficulty=rng.choice(difficulties))
+    for i in range(count)
+  ]
+
+
+def measure(cls, count: int):
+  tracemalloc.start()
+  start = time.perf_counter()
+  questions = make_questions(cls, count)
+  build = time.perf_counter() - start
+  current, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  start = time.perf_counter()
+  for quest in questions:
+    bool(quest)
+  bool_time = time.perf_counter() - start
+
+  return current, peak, build, bool_time, questions
+
+
+def main(args):
+  for cls in [DictQuestion, Question]:
+    current, peak, build, bool_time, questions = measure(cls, args.count)
+    print(f'{cls.__name__}: {current / args.count:.0f} bytes/question ({current / 1e6:.0f} MB, peak {peak / 1e6:.0f} MB), '
+          f'built in {build:.2f}s, bool() {args.count / bool_time:,.0f}/s')
+
+  start = time.perf_counter()
+  index = {}
+  for quest in questions:
+    index.setdefault(quest, len(index))
+  print(f'Question as dict key: {len(questions) / (time.perf_counter() - start):,.0f} inserts/s, '
+        f'{len(index)} distinct questions')
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
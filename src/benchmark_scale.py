@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# Scaling benchmark for the whole pipeline on synthetic data. yamls/ only has about 3,000 questions, which is too few to
+# show scaling problems, so this generates pdftohtml XML, YAML question banks, and image sets at multiples of that size
+# and reports the throughput and peak memory of each stage. Results can be saved as a baseline and compared against on
+# later runs.
+#
+# Each benchmark runs in a fresh process, so its peak RSS isn't affected by the data generation or the other benchmarks.
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from typing import Dict, List
+from xml.sax.saxutils import escape
+
+import generate_anki_from_yaml
+from benchmark_yaml import synthetic_question_dicts
+from extraction_cache import DEFAULT_CACHE_DIR
+from generate_yaml_from_pdf import (
+  QuestionFile, _iter_xml_files_text_nodes, build_questions, classify_text_nodes, copy_difficulty_values_from_existing_yaml,
+  parse_text_nodes)
+from question import Question
+
+# Roughly the number of questions in yamls/. Scale 10 means ten times this many.
+BASE_QUESTIONS = 3000
+
+DECKS = [f'english-{vehicle}-{kind}-{answer}'
+         for vehicle in ['car', 'moto'] for kind in ['rules', 'signs'] for answer in ['choice', 'true']]
+
+# Page geometry and column positions, in pdftohtml coordinates, matching the layout of the real PDFs.
+PAGE_HEIGHT = 1263
+PAGE_WIDTH = 892
+QUESTIONS_PER_PAGE = 20
+QNUM_LEFT = 60
+ANSWER_LEFT = 110
+TEXT_LEFT = 160
+CATEGORY_LEFT = 780
+
+BENCHMARKS = ['parse_xml', 'classify', 'load_yaml', 'copy_difficulty', 'question_to_note', 'anki_main']
+
+parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic question banks')
+parser.add_argument('--scales', type=int, nargs='+', choices=[10, 100, 1000], default=[10, 100],
+                    help=f'Sizes of the synthetic data, as multiples of {BASE_QUESTIONS} questions. 1000 needs several '
+                         'GB of disk and memory.')
+parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help='Benchmarks to run')
+parser.add_argument('--work-dir', help='Directory to generate the synthetic data in (default: a temporary directory)')
+parser.add_argument('--baseline', default=os.path.join(DEFAULT_CACHE_DIR, 'benchmark-baseline.json'),
+                    help='JSON file with results of an earlier run to compare against')
+parser.add_argument('--save-baseline', action='store_true', help='Save the results of this run as the baseline')
+
+
+def synthetic_questions(n: int, num_images: int, seed: int = 0) -> List[Question]:
+  """Generate `n` questions. Every fourth question has one of `num_images` images."""
+  questions = [Question(**d) for d in synthetic_question_dicts(n, seed)]
+  for i, quest in enumerate(questions):
+    quest.number = i % 999 + 1
+    if i % 4 == 0:
+      quest.question_image = f'{i // 4 % num_images:016x}.png'
+  return questions
+
+
+def tiny_png(index: int) -> bytes:
+  """A valid 8x8 grayscale PNG whose pixels depend on `index`, so that every image has different contents."""
+  def chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+  rows = b''.join(b'\0' + bytes((index >> (8 * (y % 8)) & 0xFF) ^ x for x in range(8)) for y in range(8))
+  return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 8, 8, 8, 0, 0, 0, 0))
+          + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def synthetic_pages(questions: List[Question]):
+  """
+  Lay `questions` out like pdftohtml does for the question bank PDFs. Yields a list of (top, left, txt) tuples, in
+  pdftohtml coordinates, for each page.
+  """
+  num_pages = (len(questions) + QUESTIONS_PER_PAGE - 1) // QUESTIONS_PER_PAGE
+  for page in range(num_pages):
+    nodes = [(20, QNUM_LEFT, '題號'), (20, ANSWER_LEFT, '答案'), (20, TEXT_LEFT, '題 目'), (20, CATEGORY_LEFT, '分類編號')]
+    for row, quest in enumerate(questions[page * QUESTIONS_PER_PAGE:(page + 1) * QUESTIONS_PER_PAGE]):
+      top = 60 + row * 58
+      # Long questions are wrapped onto a second line, which pdftohtml emits as a separate node.
+      words = quest.question.split(' ')
+      half = len(words) // 2 if len(words) > 12 else len(words)
+      nodes += [
+        (top, QNUM_LEFT, f'{quest.number:03}'),
+        (top, ANSWER_LEFT, quest.answer),
+        (top, TEXT_LEFT, ' '.join(words[:half])),
+        (top, CATEGORY_LEFT, quest.category),
+      ]
+      if half < len(words):
+        nodes.append((top + 20, TEXT_LEFT, ' '.join(words[half:])))
+    nodes.append((PAGE_HEIGHT - 40, PAGE_WIDTH // 2, f'第{page + 1}頁/共{num_pages}頁'))
+    yield nodes
+
+
+def write_pdftohtml_xml(questions: List[Question], path: str) -> None:
+  with open(path, 'w', encoding='utf-8') as f:
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE pdf2xml SYSTEM "pdf2xml.dtd">\n')
+    f.write('<pdf2xml producer="poppler" version="0.86.1">\n')
+    for page_number, nodes in enumerate(synthetic_pages(questions), 1):
+      f.write(f'<page number="{page_number}" position="absolute" top="0" left="0" height="{PAGE_HEIGHT}" '
+              f'width="{PAGE_WIDTH}">\n')
+      for top, left, txt in nodes:
+        f.write(f'<text top="{top}" left="{left}" width="{8 * len(txt)}" height="17" font="0">{escape(txt)}</text>\n')
+      f.write('</page>\n')
+    f.write('</pdf2xml>\n')
+
+
+def synthetic_text_nodes(questions: List[Question]) -> list:
+  """The text nodes that iter_xml_text_nodes would yield for the XML written by write_pdftohtml_xml."""
+  return [(page_number, top / PAGE_HEIGHT, left / PAGE_WIDTH, txt)
+          for page_number, nodes in enumerate(synthetic_pages(questions), 1) for top, left, txt in nodes]
+
+
+def perturbed_copy(questions: List[Question], seed: int = 1) -> List[Question]:
+  """
+  Copy `questions` as a new edition of the bank would: unknown difficulty, and the wording of every tenth question
+  changed slightly, so copy_difficulty_values_from_existing_yaml has to fall back to fuzzy matching for those.
+  """
+  rng = random.Random(seed)
+  ret = []
+  for i, quest in enumerate(questions):
+    text = quest.question
+    if i % 10 == 0:
+      words = text.split(' ')
+      words[rng.randrange(len(words))] = 'vehicles'
+      text = ' '.join(words)
+    ret.append(Question(question=text, question_image=quest.question_image, answer=quest.answer, number=quest.number,
+                        category=quest.category))
+  return ret
+
+
+def generate_data(work_dir: str, n: int) -> None:
+  """Write the synthetic question bank, per-deck YAMLs, pdftohtml XML, and images for `n` questions to `work_dir`."""
+  num_images = max(1, n // 40)
+  questions = synthetic_questions(n, num_images)
+
+  Question.dump_list_to_yaml(questions, os.path.join(work_dir, 'bank.yaml'))
+  write_pdftohtml_xml(questions, os.path.join(work_dir, 'bank.xml'))
+
+  # Split the bank into decks like yamls/. As in the real banks, the moto decks repeat some of the car questions.
+  yaml_dir = os.path.join(work_dir, 'yamls')
+  os.makedirs(yaml_dir, exist_ok=True)
+  chunk_size = len(questions) // len(DECKS)
+  for i, deck in enumerate(DECKS):
+    deck_questions = questions[i * chunk_size:(i + 1) * chunk_size]
+    if deck.startswith('english-moto-'):
+      car_chunk = DECKS.index(deck.replace('moto', 'car'))
+      deck_questions += questions[car_chunk * chunk_size:car_chunk * chunk_size + chunk_size // 3]
+    Question.dump_list_to_yaml(deck_questions, os.path.join(yaml_dir, deck + '.yaml'))
+
+  image_dir = os.path.join(work_dir, 'images')
+  os.makedirs(image_dir, exist_ok=True)
+  for index in range(num_images):
+    with open(os.path.join(image_dir, f'{index:016x}.png'), 'wb') as f:
+      f.write(tiny_png(index))
+
+
+def run_benchmark(name: str, work_dir: str) -> Dict[str, float]:
+  """
+  Run benchmark `name` on the data in `work_dir` and return its results. Only the benchmarked call is timed, not the
+  setup before it.
+  """
+  bank_path = os.path.join(work_dir, 'bank.yaml')
+  output = io.StringIO()
+
+  if name == 'parse_xml':
+    start = time.perf_counter()
+    qfile = QuestionFile(filebase='english-car-rules-choice')
+    with contextlib.redirect_stderr(output):
+      parse_text_nodes(qfile, _iter_xml_files_text_nodes([os.path.join(work_dir, 'bank.xml')]))
+    elapsed = time.perf_counter() - start
+    items = len(qfile.questions)
+  elif name == 'classify':
+    text_nodes = synthetic_text_nodes(Question.load_list_from_yaml(bank_path, prefer_binary=False))
+    start = time.perf_counter()
+    qfile = QuestionFile(filebase='english-car-rules-choice')
+    with contextlib.redirect_stderr(output):
+      build_questions(qfile, classify_text_nodes(text_nodes))
+    elapsed = time.perf_counter() - start
+    items = len(text_nodes)
+  elif name == 'load_yaml':
+    start = time.perf_counter()
+    questions = Question.load_list_from_yaml(bank_path, prefer_binary=False)
+    elapsed = time.perf_counter() - start
+    items = len(questions)
+  elif name == 'copy_difficulty':
+    existing = Question.load_list_from_yaml(bank_path, prefer_binary=False)
+    qfile = QuestionFile(filebase='english-car-rules-choice', questions=perturbed_copy(existing))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+      copy_difficulty_values_from_existing_yaml(qfile, existing)
+    elapsed = time.perf_counter() - start
+    items = len(qfile.questions)
+  elif name == 'question_to_note':
+    questions = Question.load_list_from_yaml(bank_path, prefer_binary=False)
+    start = time.perf_counter()
+    for quest in questions:
+      generate_anki_from_yaml.question_to_note(quest)
+    elapsed = time.perf_counter() - start
+    items = len(questions)
+  elif name == 'anki_main':
+    yaml_paths = [os.path.join(work_dir, 'yamls', deck + '.yaml') for deck in DECKS]
+    apkg_dir = os.path.join(work_dir, 'apkgs')
+    # Keep the synthetic renderings out of the real render cache, and start from an empty one so runs are comparable.
+    render_cache_path = os.path.join(work_dir, 'render-cache.json')
+    if os.path.exists(render_cache_path):
+      os.remove(render_cache_path)
+    args = generate_anki_from_yaml.parser.parse_args([
+      '--input-yamls', *yaml_paths, '--input-image-dir', os.path.join(work_dir, 'images'),
+      '--output-apkg', os.path.join(apkg_dir, 'all.apkg'), '--per-yaml-apkg-dir', apkg_dir,
+      '--render-cache', render_cache_path])
+    items = sum(len(Question.load_list_from_yaml(path, prefer_binary=False)) for path in yaml_paths)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+      generate_anki_from_yaml.main(args)
+    elapsed = time.perf_counter() - start
+  else:
+    raise ValueError(f'Unknown benchmark {repr(name)}')
+
+  return {'items': items, 'seconds': elapsed, 'items_per_s': items / elapsed, 'peak_rss_mb': peak_rss_mb()}
+
+
+def peak_rss_mb() -> float:
+  import resource
+  max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+  return max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_in_fresh_process(name: str, work_dir: str) -> Dict[str, float]:
+  with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+    return executor.submit(run_benchmark, name, work_dir).result()
+
+
+def format_comparison(result: Dict[str, float], baseline: Dict[str, float]) -> str:
+  if not baseline:
+    return ''
+  return (f'  ({result["items_per_s"] / baseline["items_per_s"]:.2f}x baseline throughput, '
+          f'{result["peak_rss_mb"] / baseline["peak_rss_mb"]:.2f}x baseline memory)')
+
+
+def main(args):
+  baseline = {}
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+
+  results = {}
+  for scale in args.scales:
+    key = f'{scale}x'
+    results[key] = {}
+    with contextlib.ExitStack() as stack:
+      work_dir = args.work_dir and os.path.join(args.work_dir, key)
+      if work_dir:
+        os.makedirs(work_dir, exist_ok=True)
+      else:
+        work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+
+      start = time.perf_counter()
+      generate_data(work_dir, scale * BASE_QUESTIONS)
+      print(f'{key}: generated {scale * BASE_QUESTIONS:,} questions in {time.perf_counter() - start:.1f} s')
+
+      for name in args.benchmarks:
+        result = run_in_fresh_process(name, work_dir)
+        results[key][name] = result
+        print(f'  {name:16} {result["items"]:>10,} items {result["seconds"]:8.3f} s {result["items_per_s"]:>12,.0f}/s '
+              f'peak {result["peak_rss_mb"]:7.1f} MB{format_comparison(result, baseline.get(key, {}).get(name))}')
+
+  if args.save_baseline:
+    # Keep the baseline for scales and benchmarks that weren't run this time.
+    for key, key_results in results.items():
+      baseline.setdefault(key, {}).update(key_results)
+    os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+    with open(args.baseline, 'w') as f:
+      json.dump(baseline, f, indent=2, sort_keys=True)
+    print(f'Saved baseline to {args.baseline}')
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
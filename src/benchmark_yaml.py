@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Compares YAML load/dump throughput of the pure-Python PyYAML implementation with the LibYAML-backed helpers in
+# question.py, on the checked-in YAML files and on a synthetic question bank.
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+import yaml
+
+import question
+from question import Question
+
+parser = argparse.ArgumentParser(description='Benchmark YAML load/dump of question lists')
+parser.add_argument('--yamls', nargs='+', help='YAML files to benchmark (default: every file in yamls/)')
+parser.add_argument('--synthetic-questions', type=int, default=100000,
+                    help='Number of questions in the synthetic question bank')
+
+
+def synthetic_question_dicts(n: int, seed: int = 0) -> list:
+  rng = random.Random(seed)
+  words = ['vehicle', 'driver', 'lane', 'signal', 'pedestrian', 'speed', 'limit', 'NTD', 'fined', 'license',
+           'intersection', 'motorcycle', 'turn', 'yield', 'parking', '3,600～7,200']
+  ret = []
+  for i in range(n):
+    choice = rng.random() < 0.5
+    text = ' '.join(rng.choice(words) for _ in range(rng.randint(6, 30)))
+    if choice:
+      text += ' (1) ' + rng.choice(words) + ' (2) ' + rng.choice(words) + ' (3) ' + rng.choice(words) + '.'
+    ret.append(Question(
+      question=text,
+      answer=str(rng.randint(1, 3)) if choice else rng.choice('OX'),
+      number=i % 1000 + 1,
+      category=f'{rng.randint(1, 12):02}',
+      difficulty=rng.choice(['easy', 'medium', 'hard', Question.UNKNOWN_DIFFICULTY]),
+    ).to_dict())
+  return ret
+
+
+def benchmark(name: str, texts: list):
+  start = time.perf_counter()
+  py_data = [yaml.safe_load(text) for text in texts]
+  py_load = time.perf_counter() - start
+
+  start = time.perf_counter()
+  fast_data = [question.load_yaml(text) for text in texts]
+  fast_load = time.perf_counter() - start
+
+  start = time.perf_counter()
+  py_texts = [yaml.dump(data, sort_keys=False) for data in py_data]
+  py_dump = time.perf_counter() - start
+
+  start = time.perf_counter()
+  fast_texts = [question.dump_yaml(data) for data in fast_data]
+  fast_dump = time.perf_counter() - start
+
+  if py_data != fast_data:
+    raise RuntimeError(f'{name}: load_yaml returned different data than yaml.safe_load')
+  if py_texts != fast_texts:
+    raise RuntimeError(f'{name}: dump_yaml output differs from yaml.dump')
+
+  mb = sum(len(text.encode()) for text in texts) / 1e6
+  print(f'{name}: {mb:.2f} MB')
+  print(f'  load: pure-Python {mb / py_load:6.2f} MB/s, fast {mb / fast_load:6.2f} MB/s ({py_load / fast_load:.1f}x)')
+  print(f'  dump: pure-Python {mb / py_dump:6.2f} MB/s, fast {mb / fast_dump:6.2f} MB/s ({py_dump / fast_dump:.1f}x)')
+
+
+def main(args):
+  if question._yaml()[2] is None:
+    print('WARNING: PyYAML was built without LibYAML; both columns use the pure-Python implementation', file=sys.stderr)
+
+  yaml_paths = args.yamls or sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'yamls', '*.yaml')))
+  texts = []
+  for path in yaml_paths:
+    with open(path) as f:
+      texts.append(f.read())
+  benchmark(f'{len(texts)} files from yamls/', texts)
+
+  synthetic = yaml.dump(synthetic_question_dicts(args.synthetic_questions), sort_keys=False)
+  benchmark(f'synthetic bank of {args.synthetic_questions} questions', [synthetic])
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# Builds the same YAML and .apkg files as the Makefile (PDF -> YAML -> per-deck apkg -> all.apkg), but runs
+# independent steps concurrently and decides what is out of date by hashing file contents instead of comparing mtimes.
+# At the end it prints the critical path, i.e. the chain of dependent steps that determined the total build time.
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+from extraction_cache import DEFAULT_CACHE_DIR
+from generate_yaml_from_pdf import QuestionFile
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SRC_DIR)
+
+parser = argparse.ArgumentParser(description='Build all YAML and .apkg files, running independent steps in parallel')
+parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Maximum number of steps to run at once')
+parser.add_argument('--pdf-dir', default=os.path.join(REPO_DIR, 'pdfs'), help='Directory containing the input PDFs')
+parser.add_argument('--yaml-dir', default=os.path.join(REPO_DIR, 'yamls'), help='Directory to write YAML files to')
+parser.add_argument('--image-dir', default=os.path.join(REPO_DIR, 'images'), help='Directory to write images to')
+parser.add_argument('--apkg-dir', default=os.path.join(REPO_DIR, 'apkgs'), help='Directory to write .apkg files to')
+parser.add_argument('--state-file', default=os.path.join(DEFAULT_CACHE_DIR, 'build-state.json'),
+                    help='File recording the input hashes of each step as of its last successful run')
+parser.add_argument('--force', action='store_true', help='Run every step, even if it is up to date')
+parser.add_argument('--dry-run', action='store_true', help='Only print which steps are out of date')
+
+
+class Step:
+  """
+  One command in the build. The step is out of date if the hashes of its inputs (or its command) changed since its
+  last successful run, or if any of its outputs are missing.
+  """
+  def __init__(self, name: str, command: List[str], inputs: List[str], outputs: List[str], deps: List['Step'] = ()):
+    self.name = name
+    self.command = command
+    self.inputs = inputs
+    self.outputs = outputs
+    self.deps = list(deps)
+
+    # One of 'built', 'up to date', 'out of date' (with --dry-run), 'failed', or 'skipped' (because a dependency failed).
+    self.status = None
+    self.duration = 0.0
+
+
+class FileHasher:
+  """
+  Computes the SHA-256 of files. Hashes from the previous build are reused for files whose size and mtime haven't
+  changed, so unchanged PDFs aren't read again.
+  """
+  def __init__(self, old_entries: Dict[str, dict]):
+    self._old_entries = old_entries
+    self.entries = {}
+
+  def sha256(self, path: str) -> str:
+    st = os.stat(path)
+    entry = self.entries.get(path) or self._old_entries.get(path)
+    if not entry or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+      sha256 = hashlib.sha256()
+      with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+          sha256.update(chunk)
+      entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha256.hexdigest()}
+    self.entries[path] = entry
+    return entry['sha256']
+
+  def step_digest(self, step: Step) -> str:
+    sha256 = hashlib.sha256(json.dumps(step.command).encode('utf-8'))
+    for path in step.inputs:
+      sha256.update(f'\0{path}\0{self.sha256(path)}'.encode('utf-8'))
+    return sha256.hexdigest()
+
+
+def plan_steps(args) -> List[Step]:
+  """Return the steps of the build, in an order where every step comes after its dependencies."""
+  # Like the Makefile, every step depends on all of src/, since the scripts import each other.
+  src_files = sorted(glob.glob(os.path.join(SRC_DIR, '*.py')))
+
+  yaml_steps = []
+  apkg_steps = []
+  for input_pdf in sorted(glob.glob(os.path.join(args.pdf_dir, '*.pdf'))):
+    qfile = QuestionFile(filebase=os.path.splitext(os.path.basename(input_pdf))[0])
+    file_id = qfile.getFileID()
+    output_yaml = os.path.join(args.yaml_dir, file_id + '.yaml')
+
+    command = [sys.executable, os.path.join(SRC_DIR, 'generate_yaml_from_pdf.py'), '--input-pdf', input_pdf,
+               '--output-yaml', output_yaml]
+    if os.path.exists(output_yaml):
+      command += ['--existing-yaml', output_yaml]
+    if qfile.signsrules == 'signs':
+      command += ['--output-image-dir', args.image_dir]
+    yaml_step = Step(f'yaml {file_id}', command, [input_pdf] + src_files, [output_yaml])
+    yaml_steps.append(yaml_step)
+
+    output_apkg = os.path.join(args.apkg_dir, file_id + '.apkg')
+    apkg_steps.append(Step(
+      f'apkg {file_id}',
+      [sys.executable, os.path.join(SRC_DIR, 'generate_anki_from_yaml.py'), '--input-yamls', output_yaml,
+       '--input-image-dir', args.image_dir, '--output-apkg', output_apkg, '--incremental'],
+      [output_yaml] + src_files, [output_apkg], [yaml_step]))
+
+  yaml_paths = [step.outputs[0] for step in yaml_steps]
+  output_apkg = os.path.join(args.apkg_dir, 'all.apkg')
+  all_step = Step(
+    'apkg all',
+    [sys.executable, os.path.join(SRC_DIR, 'generate_anki_from_yaml.py'), '--input-yamls', *yaml_paths,
+     '--input-image-dir', args.image_dir, '--output-apkg', output_apkg, '--incremental'],
+    yaml_paths + src_files, [output_apkg], yaml_steps)
+
+  return yaml_steps + apkg_steps + [all_step]
+
+
+async def run_step(step: Step, tasks: Dict[str, asyncio.Task], semaphore: asyncio.Semaphore, hasher: FileHasher,
+                   digests: Dict[str, str], args) -> None:
+  for dep in step.deps:
+    await tasks[dep.name]
+  if any(dep.status in ('failed', 'skipped') for dep in step.deps):
+    step.status = 'skipped'
+    return
+
+  # Hashing the inputs reads whole files, so keep it off the event loop.
+  digest = await asyncio.to_thread(hasher.step_digest, step)
+  if not args.force and digests.get(step.name) == digest and all(os.path.exists(path) for path in step.outputs):
+    step.status = 'up to date'
+    return
+  if args.dry_run:
+    step.status = 'out of date'
+    print(f'out of date: {step.name}')
+    return
+
+  async with semaphore:
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+      *step.command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    output, _ = await proc.communicate()
+    step.duration = time.perf_counter() - start
+
+  if proc.returncode:
+    step.status = 'failed'
+    print(f'FAILED {step.name} (exit status {proc.returncode}):\n{output.decode("utf-8", errors="replace")}',
+          file=sys.stderr)
+    return
+
+  step.status = 'built'
+  digests[step.name] = digest
+  print(f'{step.duration:7.2f}s  {step.name}')
+
+
+async def run_steps(steps: List[Step], hasher: FileHasher, digests: Dict[str, str], args) -> None:
+  semaphore = asyncio.Semaphore(args.jobs)
+  tasks = {}
+  # Steps come after their dependencies, so every dependency's task exists by the time a step's task is created.
+  for step in steps:
+    tasks[step.name] = asyncio.create_task(run_step(step, tasks, semaphore, hasher, digests, args))
+  await asyncio.gather(*tasks.values())
+
+
+def critical_path(steps: List[Step]) -> List[Step]:
+  """Return the chain of dependent steps with the largest total duration."""
+  # Maps each step's name to (total duration of the longest chain ending with it, the step before it in that chain).
+  longest: Dict[str, tuple] = {}
+  for step in steps:
+    prev: Optional[Step] = max(step.deps, key=lambda dep: longest[dep.name][0], default=None)
+    longest[step.name] = (step.duration + (longest[prev.name][0] if prev else 0), prev)
+
+  ret = []
+  step = max(steps, key=lambda step: longest[step.name][0])
+  while step:
+    ret.append(step)
+    step = longest[step.name][1]
+  return ret[::-1]
+
+
+def main(args):
+  state = {}
+  if os.path.exists(args.state_file):
+    with open(args.state_file) as f:
+      state = json.load(f)
+
+  steps = plan_steps(args)
+  hasher = FileHasher(state.get('files', {}))
+  digests = state.get('steps', {})
+  for path in [args.yaml_dir, args.image_dir, args.apkg_dir]:
+    os.makedirs(path, exist_ok=True)
+
+  start = time.perf_counter()
+  asyncio.run(run_steps(steps, hasher, digests, args))
+  wall_time = time.perf_counter() - start
+
+  if not args.dry_run:
+    os.makedirs(os.path.dirname(os.path.abspath(args.state_file)), exist_ok=True)
+    tmp_path = args.state_file + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({'steps': digests, 'files': hasher.entries}, f, indent=0, sort_keys=True)
+    os.replace(tmp_path, args.state_file)
+
+  counts = {}
+  for step in steps:
+    counts[step.status] = counts.get(step.status, 0) + 1
+  print(', '.join(f'{count} {status}' for status, count in counts.items()))
+
+  built = [step for step in steps if step.status == 'built']
+  if built:
+    path = critical_path(steps)
+    print(f'{wall_time:7.2f}s  total ({sum(step.duration for step in built):.2f}s of work in {len(built)} steps)')
+    print(f'{sum(step.duration for step in path):7.2f}s  critical path: '
+          + ' -> '.join(f'{step.name} ({step.duration:.2f}s)' for step in path if step.duration))
+
+  if any(step.status == 'failed' for step in steps):
+    sys.exit(1)
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
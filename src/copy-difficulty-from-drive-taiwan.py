@@ -2,47 +2,160 @@
 # Copy difficulty ratings from https://github.com/robhawkins/drive-taiwan
 # Note: This only works for the "signs" PDFs, because those haven't been updated in the time since drive-taiwan was
 # published.
+#
+# Difficulties can come from several sources at once: Anki exports like drive-taiwan's "All Decks.txt" (tab-separated,
+# question ID in the first column and difficulty in the last), CSV files with "id" and "difficulty" columns, or YAML
+# question lists from another checkout of this repo. Question IDs look like "english-car-signs-true-001".
+#
+# Only questions with an unknown difficulty are updated, and only YAML files that actually change are rewritten. The
+# exit status is 1 if any question couldn't be matched or matched conflicting difficulties.
 
 import argparse
+import csv
 import os
 import sys
-import yaml
+from typing import Dict, Iterator, List, Tuple
+
+from question import Question, dump_yaml, load_yaml
 
 parser = argparse.ArgumentParser()
-parser.add_argument('--input', required=True, help='Path to "All Decks.txt" file')
+parser.add_argument('--inputs', '--input', required=True, nargs='+',
+                    help='Files to read difficulties from: "All Decks.txt"-style Anki exports (.txt or .tsv), CSV files '
+                         '(.csv), or YAML question lists (.yaml)')
 parser.add_argument('--yamls', required=True, nargs='+', help='YAML files to update')
 
 
-def main(args):
-  question_id_to_difficulty = {}
-  with open(args.input) as f:
+def question_id(yaml_path: str, number: int) -> str:
+  return f"{os.path.basename(yaml_path)[:-len('.yaml')]}-{number:03}"
+
+
+def read_anki_export(path: str) -> Iterator[Tuple[str, str]]:
+  with open(path) as f:
     for line in f:
-      line = line.rstrip('\n')
-      question_id = line.split('\t')[0]
-      difficulty = line.split('\t')[-1] or 'unknown_difficulty'
-      question_id_to_difficulty[question_id] = difficulty
+      fields = line.rstrip('\n').split('\t')
+      yield fields[0], fields[-1]
+
+
+def read_csv(path: str) -> Iterator[Tuple[str, str]]:
+  with open(path, newline='') as f:
+    for row in csv.DictReader(f):
+      yield row['id'], row['difficulty']
+
+
+def read_yaml(path: str) -> Iterator[Tuple[str, str]]:
+  with open(path) as f:
+    data = load_yaml(f)
+  for entry in data:
+    yield question_id(path, entry['number']), entry.get('difficulty', '')
+
+
+READERS = {
+  '.txt': read_anki_export,
+  '.tsv': read_anki_export,
+  '.csv': read_csv,
+  '.yaml': read_yaml,
+  '.yml': read_yaml,
+}
+
+
+class DifficultyLookup:
+  """
+  Maps question IDs to difficulties, merged from several sources. An empty difficulty means an unknown one, and
+  unknown difficulties never override known ones. An ID that is given different known difficulties (by different
+  sources, or twice by the same one) is conflicting, and has no difficulty.
+  """
+  def __init__(self):
+    self._seen = set()
+    self._difficulties: Dict[str, Tuple[str, str]] = {}
+    self.conflicts: Dict[str, List[Tuple[str, str]]] = {}
+
+  def add(self, qid: str, difficulty: str, source: str) -> None:
+    self._seen.add(qid)
+    if not difficulty or difficulty == Question.UNKNOWN_DIFFICULTY:
+      return
+
+    existing = self._difficulties.setdefault(qid, (difficulty, source))
+    if existing[0] != difficulty:
+      self.conflicts.setdefault(qid, [existing]).append((difficulty, source))
+
+  def add_file(self, path: str) -> None:
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+      raise RuntimeError(f'Unknown difficulty source format {repr(ext)} for {path}')
+    for qid, difficulty in READERS[ext](path):
+      self.add(qid, difficulty, path)
+
+  def get(self, qid: str):
+    """Return the difficulty of `qid`, or None if no source has it or it is conflicting."""
+    if qid in self.conflicts or qid not in self._seen:
+      return None
+    if qid not in self._difficulties:
+      return Question.UNKNOWN_DIFFICULTY
+    return self._difficulties[qid][0]
+
+
+def write_atomically(path: str, text: str) -> None:
+  tmp_path = f'{path}.{os.getpid()}.tmp'
+  with open(tmp_path, 'w') as f:
+    f.write(text)
+  os.replace(tmp_path, path)
+
+
+def main(args):
+  lookup = DifficultyLookup()
+  for path in args.inputs:
+    lookup.add_file(path)
+
+  matched = 0
+  unmatched = []
+  unknown = []
+  conflicting = []
+  rewritten = 0
 
   for yaml_file in args.yamls:
     with open(yaml_file) as f:
-      data = yaml.safe_load(f)
-    
+      text = f.read()
+    data = load_yaml(text)
+
     for entry in data:
-      if entry['difficulty'] != 'unknown_difficulty':
+      if entry['difficulty'] != Question.UNKNOWN_DIFFICULTY:
         continue
 
-      question_id = f"{os.path.basename(yaml_file)[:-len('.yaml')]}-{entry['number']:03}"
+      qid = question_id(yaml_file, entry['number'])
+      if qid in lookup.conflicts:
+        conflicting.append(qid)
+        continue
+
+      difficulty = lookup.get(qid)
+      if difficulty is None:
+        unmatched.append(qid)
+        continue
+      if difficulty == Question.UNKNOWN_DIFFICULTY:
+        # Every source that has this question has it with an unknown difficulty too, so there's nothing to copy.
+        unknown.append(qid)
+        continue
+
+      entry['difficulty'] = difficulty
+      matched += 1
+
+    new_text = dump_yaml(data)
+    if new_text != text:
+      write_atomically(yaml_file, new_text)
+      rewritten += 1
+
+  print(f'{matched} questions matched, {len(unknown)} matched with an unknown difficulty, {len(unmatched)} unmatched, '
+        f'{len(conflicting)} conflicting; rewrote {rewritten} of {len(args.yamls)} YAML files')
+  for qid in unknown:
+    print(f'  unknown difficulty: {qid}')
+  for qid in unmatched:
+    print(f'  unmatched: {qid}')
+  for qid in conflicting:
+    sources = ', '.join(f'{difficulty} in {source}' for difficulty, source in lookup.conflicts[qid])
+    print(f'  conflicting: {qid} ({sources})')
 
-      if question_id not in question_id_to_difficulty:
-        raise RuntimeError(f'Did not find question_id {question_id} in All Decks.txt')
-      
-      entry['difficulty'] = question_id_to_difficulty[question_id]
-    
-    with open(yaml_file, 'w') as f:
-      yaml.dump(data, f, sort_keys=False)
+  if unmatched or conflicting:
+    sys.exit(1)
 
 
 if __name__ == '__main__' and not hasattr(sys, 'ps1'):
-  try:
-    main(parser.parse_args())
-  except:
-    import pdb; pdb.post_mortem()
+  main(parser.parse_args())
@@ -0,0 +1,180 @@
+"""
+Persistent on-disk cache for parse_pdf.
+
+The cache directory has two kinds of entries:
+
+  pdftohtml/<pdf sha256>-<options hash>/
+      The raw pdftohtml XML and the images it extracted. These only depend on the PDF's contents and the pdftohtml
+      options (whether images are extracted, in which format, and which pages).
+
+  questions/<pdf sha256>-<options hash>-<parser fingerprint>.yaml
+      The parsed question list. These also depend on the parser, so they are keyed by a fingerprint of the parser's
+      source code. question_image values are stored as file names inside the matching pdftohtml/ entry.
+
+Entries are evicted least-recently-used first (using their mtime, which is bumped on every hit) once the cache grows
+beyond its size limit.
+"""
+
+import copy
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import List, Optional
+
+from question import Question
+
+# Source files whose contents determine the parsed question list.
+PARSER_SOURCES = ['generate_yaml_from_pdf.py', 'question.py']
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.cache')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def source_fingerprint(fnames: List[str]) -> str:
+  """Hash the contents of the given files in src/."""
+  sha256 = hashlib.sha256()
+  src_dir = os.path.dirname(os.path.abspath(__file__))
+  for fname in fnames:
+    with open(os.path.join(src_dir, fname), 'rb') as f:
+      sha256.update(f.read())
+
+  return sha256.hexdigest()[:16]
+
+
+def parser_fingerprint() -> str:
+  return source_fingerprint(PARSER_SOURCES)
+
+
+class ExtractionCache:
+  def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.fingerprint = parser_fingerprint()
+
+  @staticmethod
+  def _entry_key(pdf_hash: str, options: List[str]) -> str:
+    options_hash = hashlib.sha256(' '.join(options).encode('utf-8')).hexdigest()[:8]
+    return f'{pdf_hash}-{options_hash}'
+
+  def _pdftohtml_dir(self, pdf_hash: str, options: List[str]) -> str:
+    return os.path.join(self.cache_dir, 'pdftohtml', self._entry_key(pdf_hash, options))
+
+  def _questions_path(self, pdf_hash: str, options: List[str]) -> str:
+    return os.path.join(self.cache_dir, 'questions', f'{self._entry_key(pdf_hash, options)}-{self.fingerprint}.yaml')
+
+  def get_pdftohtml_xmls(self, pdf_hash: str, options: List[str]) -> Optional[List[str]]:
+    """
+    Return the paths to the cached pdftohtml XML for the PDF, in page order, or None. There is more than one file if
+    the PDF was extracted in several page ranges. Images are in the same directory.
+    """
+    entry_dir = self._pdftohtml_dir(pdf_hash, options)
+    xml_paths = glob.glob(os.path.join(entry_dir, '*.xml'))
+    if not xml_paths:
+      return None
+
+    _touch(entry_dir)
+    return sorted(xml_paths)
+
+  def put_pdftohtml_dir(self, pdf_hash: str, options: List[str], working_dir: str) -> str:
+    """
+    Copy the pdftohtml output in `working_dir` into the cache and return the directory it ended up in.
+
+    If another process cached the same PDF first, its entry is kept and returned instead.
+    """
+    entry_dir = self._pdftohtml_dir(pdf_hash, options)
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+
+    staging_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir), prefix='.staging-')
+    try:
+      for fname in os.listdir(working_dir):
+        shutil.copy(os.path.join(working_dir, fname), staging_dir)
+      os.rename(staging_dir, entry_dir)
+    except OSError:
+      shutil.rmtree(staging_dir, ignore_errors=True)
+      if not os.path.isdir(entry_dir):
+        raise
+
+    return entry_dir
+
+  def get_questions(self, pdf_hash: str, options: List[str]) -> Optional[List[Question]]:
+    path = self._questions_path(pdf_hash, options)
+    if not os.path.exists(path):
+      return None
+
+    questions = Question.load_list_from_yaml(path)
+
+    if any(quest.question_image is not None for quest in questions):
+      entry_dir = self._pdftohtml_dir(pdf_hash, options)
+      if not os.path.isdir(entry_dir):
+        return None
+      for quest in questions:
+        if quest.question_image is not None:
+          quest.question_image = os.path.join(entry_dir, quest.question_image)
+      _touch(entry_dir)
+
+    _touch(path)
+    return questions
+
+  def put_questions(self, pdf_hash: str, options: List[str], questions: List[Question]) -> None:
+    to_store = []
+    for quest in questions:
+      stored = copy.copy(quest)
+      if stored.question_image is not None:
+        stored.question_image = os.path.basename(stored.question_image)
+      to_store.append(stored)
+
+    path = self._questions_path(pdf_hash, options)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    Question.dump_list_to_yaml(to_store, tmp_path)
+    os.replace(tmp_path, path)
+
+  def evict(self) -> None:
+    """Delete least-recently-used entries until the cache is no bigger than max_bytes."""
+    entries = []
+    for kind in ['pdftohtml', 'questions']:
+      kind_dir = os.path.join(self.cache_dir, kind)
+      if not os.path.isdir(kind_dir):
+        continue
+      for fname in os.listdir(kind_dir):
+        if fname.startswith('.'):
+          continue
+        path = os.path.join(kind_dir, fname)
+        try:
+          entries.append((os.path.getmtime(path), _disk_usage(path), path))
+        except FileNotFoundError:
+          # Evicted by another process.
+          continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+      else:
+        try:
+          os.unlink(path)
+        except FileNotFoundError:
+          pass
+      total -= size
+
+
+def _touch(path: str) -> None:
+  try:
+    os.utime(path)
+  except FileNotFoundError:
+    pass
+
+
+def _disk_usage(path: str) -> int:
+  if not os.path.isdir(path):
+    return os.path.getsize(path)
+
+  total = 0
+  for fname in os.listdir(path):
+    total += os.path.getsize(os.path.join(path, fname))
+  return total
@@ -0,0 +1,84 @@
+"""
+Approximate text matching with MinHash and locality-sensitive hashing.
+
+Each text is split into word shingles, and its MinHash signature is cut into bands. Texts that share any band land in
+the same bucket and become candidates; candidates are then ranked by the exact Jaccard similarity of their shingle sets.
+Lookups only look at the texts sharing a bucket, so matching N texts against M is roughly O(N + M) rather than O(N * M).
+"""
+
+import random
+import re
+import zlib
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+_WORD_RE = re.compile(r'\w+')
+
+# Mersenne prime used for the universal hash functions.
+_PRIME = (1 << 61) - 1
+
+
+def shingles(text: str, size: int = 3) -> FrozenSet[str]:
+  words = _WORD_RE.findall(text.lower())
+  if len(words) < size:
+    return frozenset([' '.join(words)])
+  return frozenset(' '.join(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+  if not a and not b:
+    return 1.0
+  return len(a & b) / len(a | b)
+
+
+class FuzzyIndex:
+  """
+  Maps texts to values, and finds the value whose text is most similar to a query.
+
+  With the default 16 bands of 4 rows, pairs with a Jaccard similarity of 0.5 become candidates about half the time,
+  and pairs at 0.8 almost always do.
+  """
+  def __init__(self, bands: int = 16, rows: int = 4, seed: int = 0):
+    self.bands = bands
+    self.rows = rows
+    rng = random.Random(seed)
+    self._hash_params = [(rng.randrange(1, _PRIME), rng.randrange(_PRIME)) for _ in range(bands * rows)]
+    self._buckets: Dict[Tuple[int, tuple], List[int]] = {}
+    self._entries: List[Tuple[FrozenSet[str], Any]] = []
+
+  def _signature(self, shingle_set: FrozenSet[str]) -> List[int]:
+    # crc32 rather than hash(), which is randomized per process, so that matches are the same on every run.
+    hashes = [zlib.crc32(s.encode('utf-8')) for s in shingle_set]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in self._hash_params]
+
+  def _band_keys(self, shingle_set: FrozenSet[str]):
+    signature = self._signature(shingle_set)
+    for band in range(self.bands):
+      yield band, tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+  def add(self, text: str, value: Any) -> None:
+    shingle_set = shingles(text)
+    entry_id = len(self._entries)
+    self._entries.append((shingle_set, value))
+    for key in self._band_keys(shingle_set):
+      self._buckets.setdefault(key, []).append(entry_id)
+
+  def best_match(self, text: str, accept=None) -> Optional[Tuple[Any, float]]:
+    """
+    Return a (value, similarity) tuple for the most similar indexed text, or None if no text shares a bucket with
+    `text`. If `accept` is given, only values for which accept(value) is true are considered.
+    """
+    shingle_set = shingles(text)
+    candidates = set()
+    for key in self._band_keys(shingle_set):
+      candidates.update(self._buckets.get(key, ()))
+
+    best = None
+    for entry_id in sorted(candidates):
+      entry_shingles, value = self._entries[entry_id]
+      if accept is not None and not accept(value):
+        continue
+      similarity = jaccard(shingle_set, entry_shingles)
+      if best is None or similarity > best[1]:
+        best = (value, similarity)
+
+    return best
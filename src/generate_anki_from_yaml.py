@@ -1,84 +1,177 @@
 #!/usr/bin/env python3
 
 import argparse
-import genanki
+import functools
+import hashlib
 import html
+import json
 import os
-import re
 import sys
 import textwrap
-import yaml
 
-from typing import List
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
 
-from question import Question
+from extraction_cache import DEFAULT_CACHE_DIR, source_fingerprint
+from optimize_images import optimize_images, report_savings
+from question import CHOICE_ANSWERS, CHOICE_MARKER_RE, Question
+from timings import TIMER
+from up_to_date import Stamp, sources_fingerprint
+
+if TYPE_CHECKING:
+  # Only imported where it's used, since it's slow to import.
+  import genanki
 
 parser = argparse.ArgumentParser(description='Convert YAML file containing questions into an Anki deck')
 parser.add_argument('--input-yamls', nargs='+', required=True, help='Path to YAML file(s) to load questions from')
 parser.add_argument('--input-image-dir', help='Directory containing images')
 parser.add_argument('--output-apkg', required=True, help='Path to write Anki package file to')
-
-
-MODEL = genanki.Model(
-  1670705034,
-  "Taiwan Driver's License",
-  fields=[
-    {'name': 'Question'},
-    {'name': 'Question Image'},
-    {'name': 'Answer'},
-  ],
-  templates=[
-    {
-      'name': 'Card 1',
-      'qfmt': textwrap.dedent('''\
-          {{#Question Image}}
-            {{Question Image}}
-            <br>
-          {{/Question Image}}
-          {{Question}}
-          '''.rstrip()),
-      'afmt': textwrap.dedent('''\
-          <span class="reveal-answer-{{Answer}}">
-            {{FrontSide}}
-            <span class='answer-O'>
-              <hr id=answer>
-              <div style="font-weight: bold">O (True)</div>
-            </span>
-            <span class='answer-X'>
-              <hr id=answer>
-              <div style="font-weight: bold">X (False)</div>
-            </span>
-          </span>
-          '''.rstrip()),
-    },
-  ],
-  css=textwrap.dedent('''\
-      .card {
-        font-family: arial;
-        font-size: 20px;
-        text-align: center;
-        color: black;
-        background-color: white;
-      }
-
-      .reveal-answer-1 .answer-1, .reveal-answer-2 .answer-2, .reveal-answer-3 .answer-3 {
-        font-weight: bold;
-        color: blue;
-      }
-
-      .nightMode .reveal-answer-1 .answer-1, .nightMode .reveal-answer-2 .answer-2, .nightMode .reveal-answer-3 .answer-3 {
-        color: lightblue;
-      }
-
-      .answer-O, .answer-X {
-        display: none;
-      }
-
-      .reveal-answer-O .answer-O, .reveal-answer-X .answer-X {
-        display: block;
-      }
-      '''.rstrip()),
-)
+parser.add_argument('--per-yaml-apkg-dir',
+                    help='Optional directory to also write one .apkg per input YAML file to, named after the YAML file. '
+                         'The YAML files are only loaded once for all outputs.')
+parser.add_argument('--incremental', action='store_true',
+                    help='Keep a manifest next to the output file, only re-read YAML files and images that changed '
+                         'since the last build, and skip writing the package if nothing changed')
+parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                    help='Directory to keep the record of the last build in, for --incremental')
+parser.add_argument('--optimize-images', choices=['png', 'webp'],
+                    help='Shrink images before packaging them, either by recompressing them as PNG (lossless) or by '
+                         'converting them to WebP. Requires Pillow.')
+parser.add_argument('--max-image-dimension', type=int,
+                    help='With --optimize-images, also downscale images so that neither side is longer than this')
+parser.add_argument('--image-cache-dir', default=os.path.join(DEFAULT_CACHE_DIR, 'optimized-images'),
+                    help='Directory to cache optimized images in')
+parser.add_argument('--render-cache', default=os.path.join(DEFAULT_CACHE_DIR, 'render-cache.json'),
+                    help='File to cache rendered card fields in, so that questions are only rendered once across runs')
+parser.add_argument('--no-render-cache', action='store_true', help="Don't read or write the render cache")
+parser.add_argument('--skip-invalid', action='store_true',
+                    help="Leave out questions that can't be turned into notes (like multiple choice questions that "
+                         "don't split into three choices) instead of failing. Run validation.py for a full report.")
+parser.add_argument('--timings', metavar='PATH',
+                    help="Write the wall time and peak memory of each stage as JSON to PATH ('-' for stdout)")
+parser.add_argument('--profile', metavar='PATH',
+                    help='Run note construction and package building under cProfile and write its stats to PATH')
+
+
+# The back of the card, and the styling, which are shared by the English and the bilingual note types.
+ANSWER_TEMPLATE = textwrap.dedent('''\
+    <span class="reveal-answer-{{Answer}}">
+      {{FrontSide}}
+      <span class='answer-O'>
+        <hr id=answer>
+        <div style="font-weight: bold">O (True)</div>
+      </span>
+      <span class='answer-X'>
+        <hr id=answer>
+        <div style="font-weight: bold">X (False)</div>
+      </span>
+    </span>
+    '''.rstrip())
+
+CARD_CSS = textwrap.dedent('''\
+    .card {
+      font-family: arial;
+      font-size: 20px;
+      text-align: center;
+      color: black;
+      background-color: white;
+    }
+
+    .reveal-answer-1 .answer-1, .reveal-answer-2 .answer-2, .reveal-answer-3 .answer-3 {
+      font-weight: bold;
+      color: blue;
+    }
+
+    .nightMode .reveal-answer-1 .answer-1, .nightMode .reveal-answer-2 .answer-2, .nightMode .reveal-answer-3 .answer-3 {
+      color: lightblue;
+    }
+
+    .answer-O, .answer-X {
+      display: none;
+    }
+
+    .reveal-answer-O .answer-O, .reveal-answer-X .answer-X {
+      display: block;
+    }
+    '''.rstrip())
+
+
+@functools.lru_cache(maxsize=None)
+def get_model() -> 'genanki.Model':
+  """
+  Return the note type used by every note. genanki is only imported (and the model only built) once a package is
+  actually being built, so that --help and up-to-date runs start quickly.
+  """
+  import genanki
+  return genanki.Model(
+    1670705034,
+    "Taiwan Driver's License",
+    fields=[
+      {'name': 'Question'},
+      {'name': 'Question Image'},
+      {'name': 'Answer'},
+    ],
+    templates=[
+      {
+        'name': 'Card 1',
+        'qfmt': textwrap.dedent('''\
+            {{#Question Image}}
+              {{Question Image}}
+              <br>
+            {{/Question Image}}
+            {{Question}}
+            '''.rstrip()),
+        'afmt': ANSWER_TEMPLATE,
+      },
+    ],
+    css=CARD_CSS,
+  )
+
+
+@functools.lru_cache(maxsize=None)
+def get_bilingual_model() -> 'genanki.Model':
+  """
+  Return the note type for bilingual notes (see align_banks.py), which show the Chinese question under the English one.
+  """
+  import genanki
+  return genanki.Model(
+    1670705035,
+    "Taiwan Driver's License (English and Chinese)",
+    fields=[
+      {'name': 'Question'},
+      {'name': 'Question (Chinese)'},
+      {'name': 'Question Image'},
+      {'name': 'Answer'},
+    ],
+    templates=[
+      {
+        'name': 'Card 1',
+        'qfmt': textwrap.dedent('''\
+            {{#Question Image}}
+              {{Question Image}}
+              <br>
+            {{/Question Image}}
+            {{Question}}
+            {{#Question (Chinese)}}
+              <div class="question-zh">{{Question (Chinese)}}</div>
+            {{/Question (Chinese)}}
+            '''.rstrip()),
+        'afmt': ANSWER_TEMPLATE,
+      },
+    ],
+    css=CARD_CSS + textwrap.dedent('''
+
+        .question-zh {
+          margin-top: 1em;
+        }
+        '''.rstrip()),
+  )
+
+
+def __getattr__(name):
+  # MODEL used to be a module attribute, and is still available as one.
+  if name == 'MODEL':
+    return get_model()
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def get_tags_for_yaml(yaml_path: str):
@@ -94,20 +187,20 @@ def get_tags_for_yaml(yaml_path: str):
   return [attr_to_tag[piece] for piece in yaml_path[:-len('.yaml')].rsplit('-', 3)[1:]]
 
 
-def question_to_note(question: Question) -> genanki.Note:
-  if question.answer in {'1', '2', '3'}:
-    pieces = re.split(r'\([1-3]\)', html.escape(question.question))
+def render_question_fields(question: Question) -> Tuple[str, str]:
+  """Return the rendered Question and Question Image fields of the note for `question`."""
+  if question.answer in CHOICE_ANSWERS:
+    pieces = CHOICE_MARKER_RE.split(html.escape(question.question))
 
     if len(pieces) != 4:
       raise ValueError(f'Could not parse multiple choice question {repr(question.question)}')
 
-    for choice in [1, 2, 3]:
-      pieces[choice] = f'<span class="answer-{choice}">({choice})' + pieces[choice] + '</span>'
+    rendered = [f'<span class="answer-{choice}">({choice}){piece}</span>'
+                for choice, piece in zip((1, 2, 3), pieces[1:])]
+    if pieces[0].strip():
+      rendered.insert(0, pieces[0])
 
-    if not pieces[0].strip():
-      pieces = pieces[1:]
-
-    question_text = '<br>'.join(pieces)
+    question_text = '<br>'.join(rendered)
   else:
     question_text = question.question
 
@@ -116,49 +209,370 @@ def question_to_note(question: Question) -> genanki.Note:
   else:
     image_text = ''
 
+  return question_text, image_text
+
+
+def render_bilingual_fields(question: Question, question_zh: str) -> Tuple[str, str, str]:
+  """
+  Return the rendered Question, Question (Chinese), and Question Image fields of the bilingual note for `question`,
+  whose Chinese text is `question_zh` (empty if it has no translation).
+  """
+  question_text, image_text = render_question_fields(question)
+  try:
+    question_zh_text, _ = render_question_fields(Question(question=question_zh, answer=question.answer))
+  except ValueError:
+    # The Chinese banks don't always mark choices in a way we can split, so show those as plain text.
+    question_zh_text = html.escape(question_zh)
+  return question_text, question_zh_text, image_text
+
+
+def question_to_note(question: Question, render_cache: 'RenderCache' = None) -> 'genanki.Note':
+  import genanki
+
+  if render_cache is not None:
+    question_text, image_text = render_cache.render(question)
+  else:
+    question_text, image_text = render_question_fields(question)
+
   return genanki.Note(
-    model=MODEL,
+    model=get_model(),
     fields=[question_text, image_text, question.answer],
     tags=[question.difficulty])
 
 
-def main(args):
-  deck = genanki.Deck(
-    1395868281,
-    "Taiwan Driver's License Written Test")
-  media_files = []
-  guid_to_note = {}
+class RenderedQuestion(NamedTuple):
+  """
+  Everything needed to build the note for a question. Rendering is cheap compared to building a genanki.Note, so
+  notes are only built once duplicate questions have been merged (see build_package).
+  """
+  fields: Tuple[str, str, str]
+  tags: List[str]
+  image: Optional[str]
 
-  for yaml_path in args.input_yamls:
+
+def rendered_questions_for_yaml(yaml_path: str, render_cache: 'RenderCache' = None,
+                                skip_invalid: bool = False) -> List[RenderedQuestion]:
+  """
+  Load and render the questions in `yaml_path`. If `skip_invalid` is set, questions that can't be turned into notes
+  (see validation.py) are left out with a warning, instead of raising a ValueError.
+  """
+  with TIMER.stage('yaml_load'):
     questions = Question.load_list_from_yaml(yaml_path)
-    tags = get_tags_for_yaml(yaml_path)
 
+  if skip_invalid:
+    from validation import UNBUILDABLE_KINDS, bank_format, question_anomalies
+    signsrules, truechoice = bank_format(os.path.splitext(os.path.basename(yaml_path))[0])
+    valid_questions = []
     for question in questions:
-      note = question_to_note(question)
-
-      if note.guid in guid_to_note:
-        # We've already generated this Note. Add additional tags to it, if any, and continue.
-        # TODO Not sure if it's necessary to extract only the new tags, instead of just appending all of them.
-        #      We should update genanki to remove duplicate tags so we don't have to worry about it.
-        new_tags = set(tags) - set(guid_to_note[note.guid].tags)
-        guid_to_note[note.guid].tags.extend(new_tags)
+      problems = [message for kind, message in question_anomalies(question, signsrules, truechoice)
+                  if kind in UNBUILDABLE_KINDS]
+      if problems:
+        print(f'{yaml_path}: skipping question {question.number}: {"; ".join(problems)}', file=sys.stderr)
+      else:
+        valid_questions.append(question)
+    questions = valid_questions
+
+  if render_cache is None:
+    render_cache = RenderCache(None)
+
+  with TIMER.stage('render'), TIMER.profile():
+    return [RenderedQuestion((*render_cache.render(question), question.answer), [question.difficulty],
+                             question.question_image)
+            for question in questions]
+
+
+class RenderCache:
+  """
+  Caches the output of render_question_fields, both in memory and in a file that is kept across runs.
+
+  Entries are keyed by a hash of the question text, image, and answer, which are the only fields that affect the
+  rendering. The same question often appears in several YAMLs (e.g. in both the car and moto banks) with a different
+  number and category, and it's only rendered once. The cache is discarded when this file or question.py
+  changes.
+
+  Entries are saved in least-recently-used order, and only the `max_entries` most recently used ones are kept, so
+  renderings of questions that no longer exist don't pile up across builds.
+  """
+  VERSION = 1
+  MAX_ENTRIES = 20000
+
+  def __init__(self, path: Optional[str], max_entries: int = MAX_ENTRIES):
+    self.path = path
+    self.max_entries = max_entries
+    self.fingerprint = source_fingerprint(['generate_anki_from_yaml.py', 'question.py'])
+    self._entries = {}
+    self._used = {}
+    self._dirty = False
+
+    if path and os.path.exists(path):
+      with open(path) as f:
+        data = json.load(f)
+      if data.get('version') == self.VERSION and data.get('fingerprint') == self.fingerprint:
+        self._entries = data['entries']
+
+  @staticmethod
+  def _key(question: Question) -> str:
+    render_inputs = (question.question, question.question_image, question.answer)
+    return hashlib.blake2b(repr(render_inputs).encode('utf-8'), digest_size=16).hexdigest()
+
+  def render(self, question: Question) -> Tuple[str, str]:
+    key = self._key(question)
+    self._used[key] = None
+    fields = self._entries.get(key)
+    if fields is None:
+      fields = render_question_fields(question)
+      self._entries[key] = fields
+      self._dirty = True
+    return fields
+
+  def save(self) -> None:
+    if not self.path:
+      return
+
+    # Move the entries used in this run to the end, and drop the least recently used ones beyond max_entries.
+    keys = [key for key in self._entries if key not in self._used] + list(self._used)
+    keys = keys[max(0, len(keys) - self.max_entries):]
+    if not self._dirty and keys == list(self._entries):
+      return
+    self._entries = {key: self._entries[key] for key in keys}
+
+    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+    # Several builds may run at once (e.g. make -j), so write to a temporary file and rename it into place.
+    tmp_path = f'{self.path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({'version': self.VERSION, 'fingerprint': self.fingerprint, 'entries': self._entries}, f)
+    os.replace(tmp_path, self.path)
+    self._dirty = False
+
+
+class BuildManifest:
+  """
+  Records what went into an .apkg, so that an incremental rebuild can reuse the parts that haven't changed.
+
+  For each input YAML, the manifest stores the YAML's SHA-256 and the fields, tags, and image of every question
+  rendered from it, so an unchanged YAML doesn't need to be parsed or rendered again. For each media file, it stores
+  the size, mtime, and SHA-256, so an unchanged image doesn't need to be hashed again.
+  """
+  VERSION = 2
+
+  def __init__(self, path: str, skip_invalid: bool = False):
+    self.path = path
+    self.fingerprint = source_fingerprint(['generate_anki_from_yaml.py', 'question.py', 'validation.py'])
+    # Questions recorded with --skip-invalid may have been filtered, so they can't be reused without it, or vice versa.
+    if skip_invalid:
+      self.fingerprint += '-skip-invalid'
+
+    self._old = {}
+    if os.path.exists(path):
+      with open(path) as f:
+        self._old = json.load(f)
+      if self._old.get('version') != self.VERSION or self._old.get('fingerprint') != self.fingerprint:
+        self._old = {}
+
+    self._yamls = {}
+    self._media = {}
+    self.changed = not self._old
+
+  def cached_rendered_questions_for_yaml(self, yaml_path: str) -> Optional[List[RenderedQuestion]]:
+    """Return the questions recorded for `yaml_path` in the previous build, or None if the YAML has changed since."""
+    old_entry = self._old.get('yamls', {}).get(yaml_path)
+    if not old_entry or old_entry['sha256'] != _file_sha256(yaml_path):
+      return None
+
+    return [RenderedQuestion(tuple(entry['fields']), entry['tags'], entry['image']) for entry in old_entry['questions']]
+
+  def record_yaml(self, yaml_path: str, rendered_questions: List[RenderedQuestion]) -> None:
+    yaml_hash = _file_sha256(yaml_path)
+    old_entry = self._old.get('yamls', {}).get(yaml_path)
+    if not old_entry or old_entry['sha256'] != yaml_hash:
+      self.changed = True
+
+    self._yamls[yaml_path] = {
+      'sha256': yaml_hash,
+      'questions': [rendered._asdict() for rendered in rendered_questions],
+    }
+
+  def add_media_files(self, media_files: List[str]) -> None:
+    old_media = self._old.get('media', {})
+    for path in media_files:
+      st = os.stat(path)
+      old_entry = old_media.get(path)
+      if old_entry and old_entry['size'] == st.st_size and old_entry['mtime_ns'] == st.st_mtime_ns:
+        self._media[path] = old_entry
         continue
 
-      note.tags.extend(tags)
+      media_hash = _file_sha256(path)
+      self._media[path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': media_hash}
+
+      if not old_entry or old_entry['sha256'] != media_hash:
+        self.changed = True
+
+    if set(self._yamls) != set(self._old.get('yamls', {})) or set(self._media) != set(old_media):
+      self.changed = True
+
+  def save(self) -> None:
+    with open(self.path, 'w') as f:
+      json.dump({
+        'version': self.VERSION,
+        'fingerprint': self.fingerprint,
+        'yamls': self._yamls,
+        'media': self._media,
+      }, f)
+
 
-      guid_to_note[note.guid] = note
+@functools.lru_cache(maxsize=None)
+def _file_sha256(path: str) -> str:
+  with open(path, 'rb') as f:
+    return hashlib.sha256(f.read()).hexdigest()
 
-      if question.question_image:
-        media_files.append(os.path.join(args.input_image_dir, question.question_image))
 
-  for _, note in guid_to_note.items():
-    deck.add_note(note)
+def build_package(yaml_paths: List[str], rendered_by_yaml: Dict[str, List[RenderedQuestion]], input_image_dir: str,
+                  image_map: Dict[str, str] = None) -> 'genanki.Package':
+  """
+  Build a package containing the questions from `yaml_paths`, tagged according to the YAML they came from.
+
+  `rendered_by_yaml` maps each YAML path to its rendered questions. A question that appears in several YAMLs gets a
+  single note, with the tags of all of them. Duplicates are merged before any notes are built, so there is exactly one
+  genanki.Note per unique question.
+
+  If `image_map` is given, it maps the path of each image in `input_image_dir` to a replacement file (see
+  optimize_images.py) that is packaged in its place. Notes keep their GUIDs when the image name changes.
+  """
+  import genanki
+
+  # Maps the fields of each unique question to its image and its tags. The tags are dict keys, which act as an ordered
+  # set: they keep the order they were first added in, without duplicates.
+  unique_questions: Dict[Tuple[str, str, str], Tuple[Optional[str], Dict[str, None]]] = {}
+
+  with TIMER.stage('dedup'):
+    for yaml_path in yaml_paths:
+      yaml_tags = get_tags_for_yaml(yaml_path)
+
+      for rendered in rendered_by_yaml[yaml_path]:
+        entry = unique_questions.get(rendered.fields)
+        if entry is None:
+          entry = unique_questions[rendered.fields] = (rendered.image, dict.fromkeys(rendered.tags))
+        entry[1].update(dict.fromkeys(yaml_tags))
+
+  deck = genanki.Deck(
+    1395868281,
+    "Taiwan Driver's License Written Test")
+  media_files = {}
+
+  with TIMER.stage('note_construction'):
+    for fields, (image, tags) in unique_questions.items():
+      guid = genanki.guid_for(*fields)
+      if image:
+        media_path = os.path.join(input_image_dir, image)
+        if image_map:
+          media_path = image_map[media_path]
+          new_image = os.path.basename(media_path)
+          if new_image != image:
+            fields = (fields[0], fields[1].replace(f'<img src="{image}">', f'<img src="{new_image}">'), fields[2])
+        media_files[media_path] = None
+
+      deck.add_note(genanki.Note(model=get_model(), fields=list(fields), tags=list(tags), guid=guid))
 
   package = genanki.Package(deck)
-  # TODO I'm not sure it's necessary to deduplicate the media files here. We should update genanki to remove duplicate
-  #      media files so we don't have to worry about it.
-  package.media_files = list(set(media_files))
-  package.write_to_file(args.output_apkg)
+  package.media_files = list(media_files)
+  return package
+
+
+def write_package(package: 'genanki.Package', output_apkg: str, manifest: Optional[BuildManifest]) -> None:
+  if manifest:
+    manifest.add_media_files(package.media_files)
+    if not manifest.changed and os.path.exists(output_apkg):
+      print(f'{output_apkg} is up to date')
+      # Bump the mtime so that make also considers it up to date.
+      os.utime(output_apkg)
+      return
+
+  with TIMER.stage('genanki_write'):
+    package.write_to_file(output_apkg)
+
+  if manifest:
+    manifest.save()
+
+
+# Options that affect the output packages, and the source files that do.
+STAMP_OPTIONS = ['input_yamls', 'input_image_dir', 'per_yaml_apkg_dir', 'optimize_images', 'max_image_dimension',
+                 'skip_invalid']
+
+
+def stamp_from_args(args) -> Stamp:
+  if not args.incremental:
+    return None
+  options = {name: getattr(args, name) for name in STAMP_OPTIONS}
+  options['sources'] = sources_fingerprint()
+  return Stamp(args.output_apkg, options, args.cache_dir)
+
+
+def main(args):
+  # This runs before genanki or yaml are imported, so a run with nothing to do exits almost immediately.
+  stamp = stamp_from_args(args)
+  if stamp and stamp.is_up_to_date():
+    print(f'{args.output_apkg} is up to date')
+    stamp.touch_outputs()
+    return
+
+  if args.timings or args.profile:
+    TIMER.enable(profile_path=args.profile)
+
+  # Each output is an (output apkg path, input YAML paths) tuple.
+  outputs = [(args.output_apkg, args.input_yamls)]
+  if args.per_yaml_apkg_dir:
+    os.makedirs(args.per_yaml_apkg_dir, exist_ok=True)
+    for yaml_path in args.input_yamls:
+      deck_name = os.path.splitext(os.path.basename(yaml_path))[0]
+      outputs.append((os.path.join(args.per_yaml_apkg_dir, deck_name + '.apkg'), [yaml_path]))
+
+  # Every YAML is loaded and rendered once, and the rendered questions are shared by all outputs.
+  rendered_by_yaml = {}
+  manifests = {}
+  render_cache = RenderCache(None if args.no_render_cache else args.render_cache)
+
+  for output_apkg, yaml_paths in outputs:
+    manifest = BuildManifest(output_apkg + '.manifest.json', args.skip_invalid) if args.incremental else None
+    manifests[output_apkg] = manifest
+
+    for yaml_path in yaml_paths:
+      if yaml_path not in rendered_by_yaml and manifest:
+        with TIMER.stage('manifest'):
+          rendered_by_yaml[yaml_path] = manifest.cached_rendered_questions_for_yaml(yaml_path)
+      if rendered_by_yaml.get(yaml_path) is None:
+        rendered_by_yaml[yaml_path] = rendered_questions_for_yaml(yaml_path, render_cache, args.skip_invalid)
+      if manifest:
+        with TIMER.stage('manifest'):
+          manifest.record_yaml(yaml_path, rendered_by_yaml[yaml_path])
+
+  render_cache.save()
+
+  image_map = None
+  if args.optimize_images:
+    with TIMER.stage('image_optimize'):
+      image_map = optimize_images(
+        {os.path.join(args.input_image_dir, image)
+         for rendered_questions in rendered_by_yaml.values() for _, _, image in rendered_questions if image},
+        args.image_cache_dir, args.optimize_images, args.max_image_dimension)
+
+  for output_apkg, yaml_paths in outputs:
+    if image_map:
+      report_savings(output_apkg, sorted({os.path.join(args.input_image_dir, image)
+                                          for yaml_path in yaml_paths
+                                          for _, _, image in rendered_by_yaml[yaml_path] if image}), image_map)
+
+    with TIMER.stage('build_package'), TIMER.profile():
+      package = build_package(yaml_paths, rendered_by_yaml, args.input_image_dir, image_map)
+    with TIMER.stage('manifest'):
+      write_package(package, output_apkg, manifests[output_apkg])
+
+  if stamp:
+    images = sorted({os.path.join(args.input_image_dir, image)
+                     for rendered_questions in rendered_by_yaml.values() for _, _, image in rendered_questions if image})
+    stamp.save(args.input_yamls + images, [output_apkg for output_apkg, _ in outputs])
+
+  if TIMER.enabled:
+    TIMER.write_report(args.timings)
 
 
 if __name__ == '__main__' and not hasattr(sys, 'ps1'):
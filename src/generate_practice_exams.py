@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# Generates mock written tests from the YAML question banks, as Anki subdecks or as a printable HTML page.
+
+import argparse
+import hashlib
+import html
+import os
+import random
+import sys
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from generate_anki_from_yaml import get_model, get_tags_for_yaml, render_question_fields
+from question import CHOICE_ANSWERS, Question
+
+if TYPE_CHECKING:
+  import genanki
+
+STRATA = ['category', 'vehicle', 'difficulty']
+VEHICLES = ['car', 'motorcycle']
+DECK_NAME = "Taiwan Driver's License Practice Exams"
+
+parser = argparse.ArgumentParser(description='Generate practice exams from YAML question banks')
+parser.add_argument('--input-yamls', nargs='+', required=True, help='Path to YAML file(s) to draw questions from')
+parser.add_argument('--input-image-dir', default='images', help='Directory containing images')
+parser.add_argument('--vehicle', choices=VEHICLES, help='Only use questions for this vehicle')
+parser.add_argument('--difficulties', nargs='+', help='Only use questions with these difficulties')
+parser.add_argument('--strata', nargs='*', choices=STRATA, default=STRATA,
+                    help='Question attributes to stratify by. Each exam has about the same mix of these as the bank.')
+parser.add_argument('--num-questions', type=int, default=40, help='Number of questions in each exam')
+parser.add_argument('--num-exams', type=int, default=1, help='Number of exams to generate')
+parser.add_argument('--seed', type=int, default=0,
+                    help='Seed for the first exam. Exam i uses seed + i, so any exam can be regenerated on its own.')
+parser.add_argument('--output-apkg', help='Write the exams to this Anki package, one subdeck per exam')
+parser.add_argument('--output-html', help='Write the exams to this HTML file, with an answer key after each exam')
+
+
+def load_bank(yaml_paths: List[str]) -> List[Tuple[Question, List[str]]]:
+  """
+  Return a (question, tags) tuple for each question in `yaml_paths`, where tags are the tags of the question's YAML
+  (see get_tags_for_yaml). A question that appears in several YAMLs is only included once, with the tags of all of them.
+  """
+  unique_questions: Dict[Tuple[str, str, str], Tuple[Question, Dict[str, None]]] = {}
+  for yaml_path in yaml_paths:
+    tags = get_tags_for_yaml(yaml_path)
+    for quest in Question.load_list_from_yaml(yaml_path):
+      key = (quest.question, quest.question_image, quest.answer)
+      unique = unique_questions.get(key)
+      if unique is None:
+        unique = unique_questions[key] = (quest, {})
+      unique[1].update(dict.fromkeys(tags))
+  return [(quest, list(tags)) for quest, tags in unique_questions.values()]
+
+
+def _stratum_value(question: Question, tags: List[str], name: str) -> str:
+  if name == 'vehicle':
+    # Questions that are in both the car and the motorcycle banks get a stratum of their own.
+    return '+'.join(vehicle for vehicle in VEHICLES if vehicle in tags)
+  return getattr(question, name)
+
+
+class ExamSampler:
+  """
+  Draws exams from a question bank, stratified so that each exam has about the same mix of strata (e.g. categories and
+  difficulties) as the bank.
+
+  The bank is indexed by stratum once, and each stratum's share of an exam is computed once per exam size, so drawing
+  an exam only samples from the precomputed index lists.
+  """
+  def __init__(self, bank: List[Tuple[Question, List[str]]], strata: List[str] = STRATA):
+    self._questions = [quest for quest, _ in bank]
+    self._strata: Dict[tuple, List[int]] = {}
+    for index, (quest, tags) in enumerate(bank):
+      key = tuple(_stratum_value(quest, tags, name) for name in strata)
+      self._strata.setdefault(key, []).append(index)
+    self._keys = sorted(self._strata)
+    self._allocations: Dict[int, List[Tuple[tuple, int, float]]] = {}
+
+  def allocation(self, num_questions: int) -> List[Tuple[tuple, int, float]]:
+    """
+    Return a (stratum, count, remainder) tuple for each stratum that can contribute to an exam of `num_questions`
+    questions. The stratum's quota, proportional to its size, is count + remainder: every exam takes `count` questions
+    from it, plus one more with probability `remainder` (see sample).
+    """
+    if num_questions in self._allocations:
+      return self._allocations[num_questions]
+
+    total = len(self._questions)
+    if not 0 < num_questions <= total:
+      raise ValueError(f'Cannot draw {num_questions} questions from a bank of {total}')
+
+    ret = []
+    for key in self._keys:
+      quota = len(self._strata[key]) * num_questions / total
+      ret.append((key, int(quota), quota - int(quota)))
+    self._allocations[num_questions] = ret
+    return ret
+
+  def sample(self, num_questions: int, seed: int) -> List[Question]:
+    """
+    Draw an exam. The same seed always gives the same exam.
+
+    The seats left over after each stratum gets its whole number of questions are handed out by systematic sampling
+    over the strata's remainders, in an order shuffled for each exam. That gives each stratum an extra seat with
+    probability equal to its remainder, so over many exams every stratum (and every question) is drawn in proportion to
+    its share of the bank, and each exam still has exactly `num_questions` questions.
+    """
+    rng = random.Random(seed)
+    allocation = self.allocation(num_questions)
+    extra = num_questions - sum(count for _, count, _ in allocation)
+
+    order = list(range(len(allocation)))
+    rng.shuffle(order)
+    # Seats are at point, point + 1, ..., on the line made of the remainders laid end to end. The remainders add up to
+    # `extra` and are each less than 1, so each stratum gets at most one seat.
+    point = rng.random()
+    cumulative = 0.0
+    counts = [count for _, count, _ in allocation]
+    for i in order:
+      cumulative += allocation[i][2]
+      if point < cumulative and extra:
+        counts[i] += 1
+        extra -= 1
+        point += 1
+    # Rounding can leave the remainders a hair short of `extra`, in which case the last seat hasn't been handed out.
+    for i in reversed(order):
+      if extra and allocation[i][2] and counts[i] == allocation[i][1]:
+        counts[i] += 1
+        extra -= 1
+
+    picked = []
+    for (key, _, _), count in zip(allocation, counts):
+      if count:
+        picked.extend(rng.sample(self._strata[key], count))
+    rng.shuffle(picked)
+    return [self._questions[index] for index in picked]
+
+
+def exam_title(seed: int) -> str:
+  return f'Practice exam {seed}'
+
+
+def exams_to_package(exams: List[Tuple[int, List[Question]]], bank_tags: Dict[int, List[str]],
+                     input_image_dir: str) -> 'genanki.Package':
+  """
+  Build a package with a subdeck for each (seed, questions) tuple in `exams`. `bank_tags` maps id() of each question to
+  the tags of its YAMLs.
+  """
+  import genanki
+
+  decks = []
+  media_files = set()
+  for seed, questions in exams:
+    deck_name = f'{DECK_NAME}::{exam_title(seed)}'
+    deck_id = int(hashlib.sha256(deck_name.encode('utf-8')).hexdigest()[:8], 16)
+    deck = genanki.Deck(deck_id, deck_name)
+    for quest in questions:
+      fields = [*render_question_fields(quest), quest.answer]
+      # A question can be in several exams, and Anki only keeps one note per GUID, so each exam gets its own notes.
+      deck.add_note(genanki.Note(
+        model=get_model(), fields=fields, tags=[quest.difficulty, *bank_tags[id(quest)], 'practice-exam'],
+        guid=genanki.guid_for(deck_name, *fields)))
+      if quest.question_image:
+        media_files.add(os.path.join(input_image_dir, quest.question_image))
+    decks.append(deck)
+
+  package = genanki.Package(decks)
+  package.media_files = sorted(media_files)
+  return package
+
+
+HTML_STYLE = '''
+  body { font-family: arial; font-size: 14px; }
+  section { page-break-after: always; }
+  li { margin-bottom: 1em; }
+  img { max-height: 8em; display: block; }
+'''
+
+
+def exams_to_html(exams: List[Tuple[int, List[Question]]], input_image_dir: str, output_html: str) -> str:
+  image_dir = os.path.relpath(input_image_dir, os.path.dirname(os.path.abspath(output_html)))
+  pieces = [f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>{html.escape(DECK_NAME)}</title>\n'
+            f'<style>{HTML_STYLE}</style>\n</head>\n<body>\n']
+  for seed, questions in exams:
+    pieces.append(f'<section>\n<h1>{html.escape(exam_title(seed))}</h1>\n<ol>\n')
+    for quest in questions:
+      if quest.answer in CHOICE_ANSWERS:
+        question_html = render_question_fields(quest)[0]
+      else:
+        question_html = html.escape(quest.question)
+      image_html = ''
+      if quest.question_image:
+        image_html = f'<img src="{html.escape(os.path.join(image_dir, quest.question_image))}">'
+      pieces.append(f'<li>{image_html}{question_html}</li>\n')
+    pieces.append('</ol>\n</section>\n')
+
+    pieces.append(f'<section>\n<h2>Answers to {html.escape(exam_title(seed).lower())}</h2>\n<ol>\n')
+    pieces.extend(f'<li>{html.escape(quest.answer)}</li>\n' for quest in questions)
+    pieces.append('</ol>\n</section>\n')
+  pieces.append('</body>\n</html>\n')
+  return ''.join(pieces)
+
+
+def main(args):
+  if not args.output_apkg and not args.output_html:
+    parser.error('at least one of --output-apkg and --output-html is required')
+
+  bank = load_bank(args.input_yamls)
+  if args.vehicle:
+    bank = [(quest, tags) for quest, tags in bank if args.vehicle in tags]
+  if args.difficulties:
+    bank = [(quest, tags) for quest, tags in bank if quest.difficulty in args.difficulties]
+
+  sampler = ExamSampler(bank, args.strata)
+  exams = [(seed, sampler.sample(args.num_questions, seed)) for seed in range(args.seed, args.seed + args.num_exams)]
+
+  if args.output_apkg:
+    bank_tags = {id(quest): tags for quest, tags in bank}
+    exams_to_package(exams, bank_tags, args.input_image_dir).write_to_file(args.output_apkg)
+  if args.output_html:
+    with open(args.output_html, 'w') as f:
+      f.write(exams_to_html(exams, args.input_image_dir, args.output_html))
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
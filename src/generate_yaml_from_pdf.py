@@ -4,26 +4,51 @@
 # inconsistencies in style :)
 
 import argparse
+import concurrent.futures
+import fcntl
+import functools
 import glob
 import hashlib
+import json
 import os
 import re
 import shutil
 import subprocess
 import sys
 import tempfile
-from typing import List
+from typing import List, Tuple
 
+from extraction_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, ExtractionCache
+from fuzzy_index import FuzzyIndex
 from question import Question
-
-import bs4
-from natsort import natsorted
+from timings import TIMER
+from up_to_date import Stamp, sources_fingerprint
+from validation import Anomaly, validate_bank, write_report
 
 parser = argparse.ArgumentParser(description='Convert a PDF file from thb.gov.tw into a .yaml file containing a machine-readable version of the data')
 parser.add_argument('--input-pdf', required=True, help='Path to PDF file to extract')
 parser.add_argument('--existing-yaml', help='Optional path to existing YAML file to copy difficulty ratings from')
 parser.add_argument('--output-yaml', required=True, help='Path to write output YAML file to')
 parser.add_argument('--output-image-dir', help='Optional path to write output images to')
+parser.add_argument('--first-page', type=int, help='First page of the PDF to extract')
+parser.add_argument('--last-page', type=int, help='Last page of the PDF to extract')
+parser.add_argument('--page-jobs', type=int, default=1,
+                    help='Split the PDF into this many page ranges and extract them in parallel')
+parser.add_argument('--tmp-dir', help='Directory to put temporary files in, e.g. /dev/shm to keep them in memory '
+                                      '(default: the system temporary directory)')
+parser.add_argument('--no-fuzzy-match', action='store_true',
+                    help='Only copy difficulty ratings from questions in --existing-yaml that match exactly')
+parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory to cache pdftohtml output and parsed questions in')
+parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                    help='Evict least-recently-used cache entries once the cache is bigger than this')
+parser.add_argument('--no-cache', action='store_true', help="Don't read or write the extraction cache")
+parser.add_argument('--timings', metavar='PATH',
+                    help="Write the wall time and peak memory of each stage as JSON to PATH ('-' for stdout)")
+parser.add_argument('--profile', metavar='PATH',
+                    help='Run the question-building loop under cProfile and write its stats to PATH')
+parser.add_argument('--report', metavar='PATH',
+                    help="Write the problems found in the PDF as JSON to PATH ('-' for stdout), with the page and "
+                         "position of each one (see validation.py)")
 
 
 ## QuestionFile is used to build up an object and export to CSV.
@@ -47,10 +72,18 @@ class QuestionFile(object):
               'Signs-True or False／English(汽車標誌是非題-英文)' : ('car', 'signs', 'true', 'english'),
             }
 
-  for k in list(FILEMAP):
-    v = FILEMAP[k]
-    id=v[3]+'-'+v[0]+'-'+v[1]+'-'+v[2]
-    FILEMAP[id] = v
+  @classmethod
+  @functools.lru_cache(maxsize=None)
+  def file_attributes(cls):
+    """
+    Return FILEMAP plus an entry for each file ID (like 'english-car-rules-true'). This is built on first use rather
+    than when the module is imported, so that scripts which never construct a QuestionFile don't pay for it.
+    """
+    ret = dict(cls.FILEMAP)
+    for v in cls.FILEMAP.values():
+      id=v[3]+'-'+v[0]+'-'+v[1]+'-'+v[2]
+      ret[id] = v
+    return ret
 
   def __init__(self,filebase='',language='',vehicle='',signsrules='',truechoice='',questions=(),images=(),ankiexport=''):
     self.filebase = filebase
@@ -61,12 +94,15 @@ class QuestionFile(object):
     self.questions = list(questions)
     self.images = list(images)
     self.ankiexport = ankiexport
+    # Problems noticed while parsing (see validation.py), and the (page, top, left) position of each question by number.
+    self.diagnostics = []
+    self.positions = {}
 
     attributes_set = (language and vehicle and signsrules and truechoice)
     if attributes_set:
       pass
-    elif filebase in self.FILEMAP:
-      (self.vehicle, self.signsrules, self.truechoice, self.language) = self.FILEMAP[filebase]
+    elif filebase in self.file_attributes():
+      (self.vehicle, self.signsrules, self.truechoice, self.language) = self.file_attributes()[filebase]
     else:
       raise RuntimeError(f'Unknown filebase {repr(filebase)}')
 
@@ -109,6 +145,7 @@ class QuestionFile(object):
         q.question = '<img src="'+self.images[i]+'"/><br/>'+q.question
     self.finished_called = 1
   def copyImages(self, work, anki):
+    from natsort import natsorted
     if not self.finished_called:
       self.finished()
     images = [f for f in glob.glob(work + '/' + self.filebase + '*.*') if not re.match('.*\.xml', f)]
@@ -123,164 +160,489 @@ class QuestionFile(object):
       self.images.append(imagefile)
 
 
-def parse_pdf(path_to_pdf: str, has_images: bool = False) -> QuestionFile:
-  filename = os.path.splitext(os.path.basename(path_to_pdf))
-  base = filename[0]
+IGNORABLE_LINES = [
+  '題號',
+  '答案',
+  '題目圖示',
+  r'題\s*目',
+  r'第\d+頁/共\d+頁',
+  '機車標誌、標線、號誌..題',
+  '分類',
+  '編號',
+  '機車法規選擇題',
+  '機車法規是非題',
+  '汽車法規選擇題',
+  '【英文】',
+  '汽車法規是非題',
+  '汽車標誌、標線、號誌.含汽車儀表警示、指示燈...題',
+  '分類編號',
+  '分類編',
+  '號',
+  '題號答案',
+]
+
+# All the ignorable lines as one alternation. These are matched against the text with all whitespace removed.
+IGNORABLE_LINE_RE = re.compile('|'.join(f'(?:{pattern})' for pattern in IGNORABLE_LINES))
+
+# Classifies the stripped text of a node. The alternatives are tried in order, so e.g. '5' is a 'digit' and not a
+# 'number'.
+TEXT_KIND_RE = re.compile(
+  r'(?P<qnum>[0-9]{3})'
+  r'|(?P<digit>[0-9])'
+  r'|(?P<mark>[OXＯＸ])'
+  r'|(?P<two_digits>[0-9]{2})'
+  r'|(?P<number>[0-9]+)')
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+NUMERIC_KINDS = frozenset(['qnum', 'digit', 'two_digits', 'number'])
+CATEGORY_KINDS = frozenset(['digit', 'two_digits'])
+
+ANSWER_FIXUPS = {'Ｏ': 'O', 'Ｘ': 'X'}
+
+
+def classify_text(txt: str):
+  """
+  Classify the text of a single <text> node in one pass. Returns a (kind, txt_strip) tuple, where kind is one of
+  'blank', 'ignorable', 'qnum', 'digit', 'mark', 'two_digits', 'number', or 'text'.
+  """
+  txt_strip = txt.strip()
+  if not txt_strip:
+    return 'blank', txt_strip
 
-  qfile = QuestionFile(filebase=base)
+  if IGNORABLE_LINE_RE.fullmatch(WHITESPACE_RE.sub('', txt)):
+    return 'ignorable', txt_strip
+
+  m = TEXT_KIND_RE.fullmatch(txt_strip)
+  if m:
+    return m.lastgroup, txt_strip
+
+  return 'text', txt_strip
+
+
+def iter_xml_text_nodes(xml_stream):
+  """
+  Yield a (page, top_pos, left_pos, txt) tuple for each <text> node in the pdftohtml XML read from `xml_stream`, in
+  document order.
+
+  page is the page number, and top_pos and left_pos are relative to the page height and width. The XML is read with an incremental parser, and each
+  element is discarded once it has been consumed, so memory use doesn't grow with the page count.
+  """
+  from lxml import etree
+  page = pageheight = pagewidth = None
+  for event, elem in etree.iterparse(xml_stream, events=('start', 'end'), tag=('page', 'text'), recover=True):
+    if elem.tag == 'page':
+      if event == 'start':
+        page = int(elem.get('number'))
+        pageheight = int(elem.get('height'))
+        pagewidth = int(elem.get('width'))
+      else:
+        _discard_element(elem)
+      continue
+
+    if event != 'end':
+      continue
+
+    top_pos = float(elem.get('top')) / pageheight
+    left_pos = float(elem.get('left')) / pagewidth
+    txt = ''.join(elem.itertext())
+    _discard_element(elem)
+
+    yield page, top_pos, left_pos, txt
+
+
+def pdftohtml_options(has_images: bool, first_page: int = None, last_page: int = None) -> List[str]:
+  """
+  Extra pdftohtml command-line options. Without `has_images`, pdftohtml is told not to render images at all, which
+  makes it much faster.
+  """
+  options = []
+  if first_page:
+    options += ['-f', str(first_page)]
+  if last_page:
+    options += ['-l', str(last_page)]
+  if not has_images:
+    options.append('-i')
+  return options
+
+
+def iter_pdf_text_nodes(path_to_pdf: str, xmlfile: str, save_xml: bool = False, options: List[str] = ()):
+  """
+  Run pdftohtml on `path_to_pdf` and yield the text nodes of its XML output (see `iter_xml_text_nodes`).
+
+  The XML is read from pdftohtml's stdout through a pipe. If `save_xml` is set, it is also written to `xmlfile` as it
+  is read. Images (if any) are written next to `xmlfile`. `options` are passed to pdftohtml (see `pdftohtml_options`).
+  """
+  proc = subprocess.Popen(
+    ['pdftohtml', '-xml', '-stdout', *options, path_to_pdf, xmlfile],
+    stdout=subprocess.PIPE)
 
-  tempdir = tempfile.mkdtemp()
+  xml_copy = open(xmlfile, 'wb') if save_xml else None
+  try:
+    # Time spent waiting for pdftohtml's output is counted towards the pdftohtml stage.
+    xml_stream = TIMER.wrap_reader('pdftohtml', proc.stdout)
+    if xml_copy:
+      xml_stream = _TeeReader(xml_stream, xml_copy)
+    yield from iter_xml_text_nodes(xml_stream)
+  finally:
+    if xml_copy:
+      xml_copy.close()
+    proc.stdout.close()
+    retcode = proc.wait()
 
-  workingDir = tempdir + '/' + qfile.getFileID()
-  mkdir_p(workingDir)
+  if retcode:
+    raise subprocess.CalledProcessError(retcode, proc.args)
 
-  outputFile = os.path.join(tempdir, qfile.getFileID()+'.csv')
 
-  xmlfile = workingDir + '/' + base + '.xml'
+class _TeeReader:
+  """File-like wrapper that copies everything read from `stream` into `copy`."""
+  def __init__(self, stream, copy):
+    self._stream = stream
+    self._copy = copy
 
-  subprocess.check_call(
-    ['pdftohtml', '-xml', path_to_pdf, xmlfile],
-    stdout=subprocess.DEVNULL)
+  def read(self, size=-1):
+    data = self._stream.read(size)
+    self._copy.write(data)
+    return data
 
-  filehandler = open(xmlfile)
 
-  soup = bs4.BeautifulSoup(filehandler,'lxml')
+def _discard_element(elem):
+  # Free an element that iterparse has finished with, along with any earlier siblings that are still attached.
+  elem.clear()
+  while elem.getprevious() is not None:
+    del elem.getparent()[0]
+
+
+def classify_text_nodes(text_nodes):
+  """
+  Classify each of `text_nodes` (as yielded by `iter_pdf_text_nodes`), dropping blank and ignorable ones. Yields a
+  (page, top_pos, left_pos, txt, kind, txt_strip) tuple for each remaining node.
+  """
+  for page, top_pos, left_pos, txt in text_nodes:
+    kind, txt_strip = classify_text(txt)
+    if kind in ('blank', 'ignorable'):
+      continue
+    yield page, top_pos, left_pos, txt, kind, txt_strip
+
+
+def parse_text_nodes(qfile: QuestionFile, text_nodes) -> None:
+  """
+  Run the question-building state machine over `text_nodes` (as yielded by `iter_pdf_text_nodes`), appending the
+  questions it finds to `qfile`.
+  """
+  classified_nodes = TIMER.wrap_iter('classify', classify_text_nodes(TIMER.wrap_iter('xml_parse', text_nodes)))
+  build_questions(qfile, classified_nodes)
 
+
+def build_questions(qfile: QuestionFile, classified_nodes) -> None:
+  """
+  Run the question-building state machine over `classified_nodes` (as yielded by `classify_text_nodes`), appending
+  the questions it finds to `qfile`.
+  """
+  with TIMER.stage('build_questions'), TIMER.profile():
+    _build_questions(qfile, classified_nodes)
+
+
+def _build_questions(qfile: QuestionFile, classified_nodes) -> None:
   current_q = qfile.newQuestion()
 
   state = ''
   qnum = 0
+  reported_missing_answer = False
+
+  for page, top_pos, left_pos, txt, kind, txt_strip in classified_nodes:
+    if kind == 'qnum':
+      state = 'found_qnum'
+      qnum = int(txt_strip)
+      if current_q:
+        current_q.question = current_q.question.replace('\n', '')
+        current_q = qfile.newQuestion()
+      current_q.number = qnum
+      qfile.positions.setdefault(qnum, (page, top_pos, left_pos))
+      reported_missing_answer = False
+      continue
+    elif state == 'found_qnum':
+      if kind in ('digit', 'mark'):
+        state = 'found_ans'
+        if current_q.answer != '':
+          qfile.diagnostics.append(Anomaly(
+            'answer_overwritten', qnum, f'answer {current_q.answer!r} overwritten by {txt_strip!r}',
+            page, top_pos, left_pos))
+        current_q.answer = ANSWER_FIXUPS.get(txt_strip, txt_strip)
+      elif not reported_missing_answer:
+        # Every node until the next question number lands here, but only the first one is worth reporting.
+        reported_missing_answer = True
+        qfile.diagnostics.append(Anomaly(
+          'answer_not_found', qnum, f'expected an answer after the question number, got {txt_strip!r}',
+          page, top_pos, left_pos))
+    elif state == 'found_ans' and kind not in NUMERIC_KINDS:
+      current_q.question += txt
+    elif kind in CATEGORY_KINDS and left_pos > 0.75:
+      current_q.category = txt_strip
+
+
+def pdf_page_count(path_to_pdf: str) -> int:
+  output = subprocess.check_output(['pdfinfo', path_to_pdf]).decode('utf-8', errors='replace')
+  m = re.search(r'^Pages:\s+(\d+)\s*$', output, re.MULTILINE)
+  if not m:
+    raise RuntimeError(f'Could not find the page count of {path_to_pdf} in pdfinfo output')
+  return int(m.group(1))
+
+
+def split_page_range(first_page: int, last_page: int, num_chunks: int) -> List[Tuple[int, int]]:
+  """Split the pages from `first_page` to `last_page` (inclusive) into at most `num_chunks` contiguous ranges."""
+  num_pages = last_page - first_page + 1
+  num_chunks = max(1, min(num_chunks, num_pages))
+  ret = []
+  start = first_page
+  for i in range(num_chunks):
+    end = start + num_pages // num_chunks + (1 if i < num_pages % num_chunks else 0) - 1
+    ret.append((start, end))
+    start = end + 1
+  return ret
+
+
+def _classify_page_range(path_to_pdf: str, xmlfile: str, save_xml: bool, options: List[str]) -> list:
+  return list(classify_text_nodes(iter_pdf_text_nodes(path_to_pdf, xmlfile, save_xml=save_xml, options=options)))
+
+
+def iter_classified_nodes_by_page_range(path_to_pdf: str, working_dir: str, base: str, has_images: bool,
+                                        first_page: int, last_page: int, jobs: int,
+                                        save_xml: bool = False):
+  """
+  Split the PDF into `jobs` page ranges, and run pdftohtml and `classify_text_nodes` on each range in parallel.
+  Yields the classified nodes of all ranges in page order, so the result can be fed to `build_questions` just like
+  the output of a single pdftohtml run.
 
-  ignorable_lines = [ '^題號$',
-                      '^答案$',
-                      '^題目圖示$',
-                      '^題\s*目$',
-                      '^第\d+頁/共\d+頁$',
-                      '^機車標誌、標線、號誌..題$',
-                      '^分類$',
-                      '^編號$',
-                      '^機車法規選擇題$',
-                      '^機車法規是非題$',
-                      '^汽車法規選擇題$',
-                      '^【英文】$',
-                      '^汽車法規是非題$',
-                      '^汽車標誌、標線、號誌.含汽車儀表警示、指示燈...題$',
-                      '^分類編號$',
-                      '^分類編$',
-                      '^號$',
-                      '^題號答案$',
-                    ]
-
-
-  for page in soup.findAll('page'):
-    pageheight = int(page['height'])
-    pagewidth = int(page['width'])
-    for text in page.findAll('text'):
-      top_pos = float(text['top']) / pageheight
-      left_pos = float(text['left']) / pagewidth
-      txt = text.get_text()
-      txt_strip = txt.strip()
-      txt_nospace = re.sub('\s+','',txt)
-      if not txt_strip:
-        continue
-      skip = False
-      for ignore in ignorable_lines:
-        if re.match(ignore, txt_nospace):
-          skip = True
-          continue
-      if skip:
-        continue
-      if re.match('^[0-9]{3}$',txt_strip):
-        state = 'found_qnum'
-        qnum = int(txt_strip)
-        qnum_i = qnum-1
-        if current_q:
-          current_q.question = re.sub('\n','',current_q.question)
-          current_q = qfile.newQuestion()
-        current_q.number = qnum
-        continue
-      elif state == 'found_qnum':
-        if re.match('^[0-9OX]$',txt_strip) or txt_strip == 'Ｘ' or txt_strip == 'Ｏ':
-          state = 'found_ans'
-          if current_q.answer != '':
-            warning("%d: Answer being overwritten" % (qnum))
-          if txt_strip == 'Ｏ': txt_strip = 'O'
-          elif txt_strip == 'Ｘ': txt_strip = 'X'
-          current_q.answer = txt_strip
-        else:
-          warning("%d: Answer not found after question number" % (qnum))
-      elif state == 'found_ans' and not re.match('^[0-9]+$',txt_strip):
-        current_q.question += txt
-      elif re.match('^[0-9]{1,2}$',txt_strip) and left_pos > 0.75:
-        current_q.category = txt_strip
-  filehandler.close()
-
-  for quest in qfile.questions:
-    quest.question = normalize_question_text(quest.question)
-
-    # Fix a specific malformed question.
-    quest.question = quest.question.replace('¬#¦', '(3) ')
-
-  if has_images:
-    image_paths = glob.glob(os.path.join(workingDir, '*.png'))
-
-    if len(qfile.questions) != len(image_paths):
-      raise RuntimeError(
-        f'Different number of questions and images: {len(qfile.questions)} questions and {len(image_paths)} images')
+  Each range gets its own XML file (if `save_xml` is set) and image file names, which sort in page order.
+  """
+  first_page = first_page or 1
+  last_page = last_page or pdf_page_count(path_to_pdf)
+  page_ranges = split_page_range(first_page, last_page, jobs)
+
+  with concurrent.futures.ProcessPoolExecutor(max_workers=len(page_ranges)) as executor:
+    futures = [
+      executor.submit(
+        _classify_page_range, path_to_pdf, os.path.join(working_dir, f'{base}.part{i:04}.xml'), save_xml,
+        pdftohtml_options(has_images, range_first, range_last))
+      for i, (range_first, range_last) in enumerate(page_ranges)
+    ]
+    for future in futures:
+      yield from future.result()
+
+
+def _iter_xml_files_text_nodes(xml_paths: List[str]):
+  for xml_path in xml_paths:
+    with open(xml_path, 'rb') as f:
+      yield from iter_xml_text_nodes(f)
+
+
+def parse_pdf(path_to_pdf: str, has_images: bool = False, cache: ExtractionCache = None, work_dir: str = None,
+              first_page: int = None, last_page: int = None, page_jobs: int = 1, strict: bool = True,
+              reuse_cached_questions: bool = True) -> QuestionFile:
+  """
+  Extract the questions from `path_to_pdf`.
 
-    for quest, image_path in zip(qfile.questions, natsorted(image_paths)):
-      quest.question_image = image_path
+  If `has_images` is set, each question's question_image is the path of its image (a PNG). The images are
+  written under `work_dir`, or in the cache if `cache` is given. If neither is given, they are left in a new temporary
+  directory. Any other temporary files are deleted before returning.
 
-  return qfile
+  If `page_jobs` is more than 1, the PDF is split into that many page ranges, which are extracted and classified in
+  parallel. The result is the same as extracting it in one go.
+
+  Problems noticed while parsing are recorded in qfile.diagnostics (see validation.py). If there are more or fewer
+  images than questions, this raises a RuntimeError if `strict` is set, and otherwise leaves every question_image
+  unset. Unless `reuse_cached_questions` is set, the questions are parsed again from the cached pdftohtml output even if
+  the cache has them, so that qfile.diagnostics and qfile.positions are filled in.
+  """
+  filename = os.path.splitext(os.path.basename(path_to_pdf))
+  base = filename[0]
 
+  qfile = QuestionFile(filebase=base)
+  options = pdftohtml_options(has_images, first_page, last_page)
+
+  if cache:
+    with TIMER.stage('cache'):
+      pdf_hash = sha256_file(path_to_pdf)
+      cached_questions = cache.get_questions(pdf_hash, options)
+    if cached_questions is not None and reuse_cached_questions:
+      qfile.questions = cached_questions
+      return qfile
+
+  own_tempdir = None
+  if work_dir is None:
+    if has_images and not cache:
+      # The caller needs the images after we return.
+      work_dir = tempfile.mkdtemp()
+    else:
+      own_tempdir = tempfile.TemporaryDirectory()
+      work_dir = own_tempdir.name
 
-def copy_difficulty_values_from_existing_yaml(dst: QuestionFile, src: List[Question]):
-  dd = DifficultyDict()
-  for quest in src:
-    dd[quest] = quest.difficulty
+  try:
+    workingDir = work_dir + '/' + qfile.getFileID()
+    mkdir_p(workingDir)
 
-  for quest in dst.questions:
-    quest.difficulty = dd.get(quest)
+    xmlfile = workingDir + '/' + base + '.xml'
 
+    cached_xmls = cache.get_pdftohtml_xmls(pdf_hash, options) if cache else None
+    if cached_xmls:
+      workingDir = os.path.dirname(cached_xmls[0])
+      parse_text_nodes(qfile, _iter_xml_files_text_nodes(cached_xmls))
+    else:
+      if page_jobs > 1:
+        # pdftohtml, XML parsing and classification all happen in the worker processes.
+        build_questions(qfile, TIMER.wrap_iter('page_range_workers', iter_classified_nodes_by_page_range(
+          path_to_pdf, workingDir, base, has_images, first_page, last_page, page_jobs,
+          save_xml=bool(cache))))
+      else:
+        parse_text_nodes(qfile, iter_pdf_text_nodes(path_to_pdf, xmlfile, save_xml=bool(cache), options=options))
+      if cache:
+        with TIMER.stage('cache'):
+          workingDir = cache.put_pdftohtml_dir(pdf_hash, options, workingDir)
+
+    with TIMER.stage('normalize'):
+      Question.normalize_list(qfile.questions, TextFixups.for_file_id(qfile.getFileID()).apply)
+
+    if has_images:
+      from natsort import natsorted
+      image_paths = glob.glob(os.path.join(workingDir, '*.png'))
+
+      if len(qfile.questions) != len(image_paths):
+        message = (f'Different number of questions and images: {len(qfile.questions)} questions and '
+                   f'{len(image_paths)} images')
+        if strict:
+          raise RuntimeError(message)
+        qfile.diagnostics.append(Anomaly('image_count_mismatch', None, message))
+      else:
+        for quest, image_path in zip(qfile.questions, natsorted(image_paths)):
+          quest.question_image = image_path
+  finally:
+    if own_tempdir:
+      own_tempdir.cleanup()
+
+  if cache:
+    with TIMER.stage('cache'):
+      cache.put_questions(pdf_hash, options, qfile.questions)
 
-def normalize_question_text(question: str):
-  question = re.sub(r'\( *([123]) *\)',r' (\1) ', question)
-  question = question.replace('<br/>', ' ')
-  question = re.sub(' +', ' ', question)
-  question = question.strip()
-  return question
+  return qfile
 
 
-class DifficultyDict:
+def copy_difficulty_values_from_existing_yaml(dst: QuestionFile, src: List[Question], fuzzy_match: bool = True):
   """
-  Maps from `question` instances to their associated difficulty.
+  Set the difficulty of each question in `dst` from the matching question in `src`, and print a summary of how many
+  matched.
 
-  The difficulty value may be "easy", "medium", or "hard".
-
-  TODO I think we can just get rid of this and use a regular dict.
+  Questions match exactly if their normalized text, image, and answer are the same. If `fuzzy_match` is set, questions
+  without an exact match take the difficulty of the most similar question in `src` that has the same image and a known
+  difficulty, as long as it is at least FUZZY_MATCH_THRESHOLD similar.
   """
-  def __init__(self):
-    self._dict = {}
+  index = DifficultyIndex(src)
+
+  exact = 0
+  fuzzy = []
+  for quest in dst.questions:
+    difficulty, similarity = index.lookup(quest, fuzzy_match=fuzzy_match)
+    quest.difficulty = difficulty
+    if similarity == 1.0:
+      exact += 1
+    elif similarity is not None:
+      fuzzy.append((quest, similarity))
+
+  unmatched = len(dst.questions) - exact - len(fuzzy)
+  print(f'{dst.getFileID()}: difficulty copied for {exact} exact matches and {len(fuzzy)} fuzzy matches, '
+        f'{unmatched} questions unmatched')
+  for quest, similarity in fuzzy:
+    print(f'  fuzzy match for question {quest.number}: similarity {similarity:.2f}, difficulty {quest.difficulty}')
+
+
+# Corrections for malformed text in specific editions of the PDFs, applied to the normalized text of each question.
+# Keys are file IDs (see QuestionFile.getFileID), or '*' for corrections that apply to every edition. Values are lists
+# of (old, new) literal replacements.
+TEXT_FIXUPS = {
+  '*': [
+    # A malformed choice marker in one of the questions.
+    ('¬#¦', '(3) '),
+  ],
+}
+
+
+class TextFixups:
+  """Applies a list of (old, new) replacements in a single pass over the text."""
+  def __init__(self, replacements: List[Tuple[str, str]]):
+    self._replacements = dict(replacements)
+    # Longer strings first, so that a replacement isn't shadowed by one of its prefixes.
+    olds = sorted(self._replacements, key=len, reverse=True)
+    self._re = re.compile('|'.join(re.escape(old) for old in olds)) if olds else None
 
   @classmethod
-  def _key(cls, question: Question) -> str:
-    return f'{normalize_question_text(question.question)}|{question.question_image}|{question.answer}'
+  def for_file_id(cls, file_id: str, table: dict = None) -> 'TextFixups':
+    table = TEXT_FIXUPS if table is None else table
+    return cls(table.get('*', []) + table.get(file_id, []))
 
-  def __setitem__(self, question: Question, difficulty: str) -> None:
-    self._dict[self._key(question)] = difficulty
+  def apply(self, text: str) -> str:
+    if self._re is None:
+      return text
+    return self._re.sub(lambda m: self._replacements[m.group()], text)
 
-  def __getitem__(self, question: Question) -> str:
-    return self._dict[self._key(question)]
 
-  def get(self, question: Question) -> str:
-    return self._dict.get(self._key(question), Question.UNKNOWN_DIFFICULTY)
+FUZZY_MATCH_THRESHOLD = 0.8
 
-  def __repr__(self):
-    return self._dict.__repr__()
 
+class DifficultyIndex:
+  """
+  Maps from `question` instances to their associated difficulty.
+
+  The difficulty value may be "easy", "medium", or "hard". Questions are matched by their normalized text (see
+  Question.normalized_question, which computes it only once per question). Questions that don't match exactly can be
+  looked up approximately through a MinHash index, which is only built the first time a question doesn't match exactly.
+  """
+  def __init__(self, questions: List[Question] = ()):
+    self._exact = {}
+    self._fuzzy_entries = []
+    self._fuzzy = None
+    for quest in questions:
+      self.add(quest)
+
+  @classmethod
+  def _key(cls, question: Question, normalized_text: str) -> tuple:
+    return (normalized_text, question.question_image, question.answer)
+
+  def add(self, question: Question) -> None:
+    normalized_text = question.normalized_question()
+    self._exact[self._key(question, normalized_text)] = question.difficulty
+    if question.difficulty != Question.UNKNOWN_DIFFICULTY:
+      self._fuzzy_entries.append((normalized_text, (question.question_image, question.difficulty)))
+      self._fuzzy = None
+
+  def _fuzzy_index(self) -> FuzzyIndex:
+    if self._fuzzy is None:
+      self._fuzzy = FuzzyIndex()
+      for normalized_text, value in self._fuzzy_entries:
+        self._fuzzy.add(normalized_text, value)
+    return self._fuzzy
+
+  def lookup(self, question: Question, fuzzy_match: bool = True):
+    """
+    Return a (difficulty, similarity) tuple. similarity is 1.0 for an exact match, the Jaccard similarity of the
+    question texts for a fuzzy match, and None (with UNKNOWN_DIFFICULTY) if nothing matched.
+    """
+    normalized_text = question.normalized_question()
+    key = self._key(question, normalized_text)
+    if key in self._exact:
+      return self._exact[key], 1.0
+
+    if fuzzy_match:
+      match = self._fuzzy_index().best_match(normalized_text, accept=lambda value: value[0] == question.question_image)
+      if match and match[1] >= FUZZY_MATCH_THRESHOLD:
+        (_, difficulty), similarity = match
+        # A fuzzy match is never reported as exact, even if the word shingles happen to be identical.
+        return difficulty, min(similarity, 0.99)
+
+    return Question.UNKNOWN_DIFFICULTY, None
+
+  def __repr__(self):
+    return self._exact.__repr__()
 
-def warning(*objs):
-  print("WARNING: ", *objs, file=sys.stderr)
 
 def mkdir_p(path):
   try:
@@ -291,11 +653,11 @@ def mkdir_p(path):
     else: raise
 
 
-def sha256_file(path: str) -> str:
-  # This is only suitable for small files because it reads the entire file into memory.
+def sha256_file(path: str, chunk_size: int = 1 << 16) -> str:
   sha256 = hashlib.sha256()
   with open(path, 'rb') as f:
-    sha256.update(f.read())
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      sha256.update(chunk)
 
   return sha256.hexdigest()
 
@@ -316,27 +678,189 @@ def copy_images_to_output_dir_and_update_paths(questions, output_image_dir):
   This function will copy that image to images/6f53d394460c8214.png and change questions[0].question_image to
 
       '6f53d394460c8214.png'
+
+  Images are hashed in parallel, and an image is only copied if images/ doesn't already have it. A full hash is
+  recorded for every file in images/ (see ImageHashIndex), so a different image whose hash starts with the same 16
+  hex digits raises an error instead of silently overwriting the existing file.
   """
-  for quest in questions:
-    if quest.question_image is None:
-      continue
+  image_questions = [quest for quest in questions if quest.question_image is not None]
+
+  with concurrent.futures.ThreadPoolExecutor() as executor:
+    hashes = list(executor.map(sha256_file, [quest.question_image for quest in image_questions]))
 
-    dest_fname = f'{sha256_file(quest.question_image)[:16]}.png'
-    dest_path = os.path.join(output_image_dir, dest_fname)
-    shutil.copy(quest.question_image, dest_path)
+  index = ImageHashIndex(output_image_dir)
+  for quest, full_hash in zip(image_questions, hashes):
+    dest_fname = index.add(quest.question_image, full_hash)
     quest.question_image = dest_fname
+  index.save()
 
 
-def main(args):
-  qfile = parse_pdf(args.input_pdf, has_images=bool(args.output_image_dir))
+class ImageHashIndex:
+  """
+  Records the full SHA-256 of each image in an image directory, where images are named after a prefix of their hash.
+
+  The index is kept in a file in the image directory, so files that were copied by earlier builds don't need to be
+  read again. Files that are missing from the index are hashed the first time they're needed.
+  """
+  INDEX_FNAME = '.hash-index.json'
+  LOCK_FNAME = '.hash-index.lock'
+  PREFIX_LEN = 16
+
+  def __init__(self, image_dir: str):
+    self.image_dir = image_dir
+    self._path = os.path.join(image_dir, self.INDEX_FNAME)
+    try:
+      with open(self._path) as f:
+        self._fname_to_hash = json.load(f)
+    except FileNotFoundError:
+      self._fname_to_hash = {}
+    self._dirty = False
+
+  def add(self, src_path: str, full_hash: str) -> str:
+    """Copy `src_path` (whose SHA-256 is `full_hash`) into the image directory if needed and return its filename."""
+    dest_fname = full_hash[:self.PREFIX_LEN] + os.path.splitext(src_path)[1]
+    dest_path = os.path.join(self.image_dir, dest_fname)
+
+    existing_hash = self._fname_to_hash.get(dest_fname)
+    if existing_hash is not None and not os.path.exists(dest_path):
+      existing_hash = None
+    if existing_hash is None and os.path.exists(dest_path):
+      existing_hash = sha256_file(dest_path)
+      self._fname_to_hash[dest_fname] = existing_hash
+      self._dirty = True
+
+    if existing_hash is None:
+      copy_file_atomically(src_path, dest_path)
+      self._fname_to_hash[dest_fname] = full_hash
+      self._dirty = True
+    elif existing_hash != full_hash:
+      raise RuntimeError(
+        f'Hash prefix collision: {src_path} (sha256 {full_hash}) and {dest_path} (sha256 {existing_hash}) would both '
+        f'be named {dest_fname}')
+
+    return dest_fname
+
+  def save(self) -> None:
+    if not self._dirty:
+      return
+
+    # Another extraction process may have updated the index since we read it; keep its entries too. The lock keeps
+    # another process from saving between our read and our write, which would lose its entries.
+    with open(os.path.join(self.image_dir, self.LOCK_FNAME), 'w') as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        with open(self._path) as f:
+          merged = json.load(f)
+      except FileNotFoundError:
+        merged = {}
+      merged.update(self._fname_to_hash)
+
+      fd, tmp_path = tempfile.mkstemp(dir=self.image_dir, suffix='.tmp')
+      with os.fdopen(fd, 'w') as f:
+        json.dump(merged, f, indent=0, sort_keys=True)
+      os.replace(tmp_path, self._path)
+    self._dirty = False
+
+
+def copy_file_atomically(src: str, dest: str):
+  """
+  Copy `src` to `dest` such that other processes never see a partially-written `dest`.
+
+  Several extraction workers may copy the same image into images/ at the same time, so we copy to a temporary file in
+  the destination directory and then rename it into place.
+  """
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest) or '.', suffix='.tmp')
+  os.close(fd)
+  try:
+    shutil.copy(src, tmp_path)
+    os.replace(tmp_path, dest)
+  except BaseException:
+    os.unlink(tmp_path)
+    raise
+
+
+def extract_pdf_to_yaml(input_pdf: str, output_yaml: str, existing_yaml: str = None, output_image_dir: str = None,
+                        cache: ExtractionCache = None, fuzzy_match: bool = True, first_page: int = None,
+                        last_page: int = None, tmp_dir: str = None, page_jobs: int = 1,
+                        reuse_cached_questions: bool = True, evict_cache: bool = True) -> QuestionFile:
+  """
+  Extract `input_pdf` to `output_yaml`. If `evict_cache` is set, the cache is trimmed to its size limit afterwards;
+  callers that run several extractions at once should unset it and evict once they're all done, so that one extraction
+  doesn't evict cache entries that another one is still using.
+  """
+  with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+    qfile = parse_pdf(input_pdf, has_images=bool(output_image_dir), cache=cache, work_dir=work_dir,
+                      first_page=first_page, last_page=last_page, page_jobs=page_jobs,
+                      reuse_cached_questions=reuse_cached_questions)
 
-  if args.output_image_dir:
-    copy_images_to_output_dir_and_update_paths(qfile.questions, args.output_image_dir)
+    if output_image_dir:
+      with TIMER.stage('image_hash_copy'):
+        copy_images_to_output_dir_and_update_paths(qfile.questions, output_image_dir)
 
-  if args.existing_yaml:
-    copy_difficulty_values_from_existing_yaml(qfile, Question.load_list_from_yaml(args.existing_yaml))
+  if existing_yaml:
+    with TIMER.stage('yaml_load'):
+      existing_questions = Question.load_list_from_yaml(existing_yaml)
+    with TIMER.stage('difficulty_copy'):
+      copy_difficulty_values_from_existing_yaml(qfile, existing_questions, fuzzy_match)
 
-  Question.dump_list_to_yaml(qfile.questions, args.output_yaml)
+  with TIMER.stage('yaml_dump'):
+    Question.dump_list_to_yaml(qfile.questions, output_yaml)
+
+  if cache and evict_cache:
+    with TIMER.stage('cache'):
+      cache.evict()
+
+  return qfile
+
+
+def cache_from_args(args) -> ExtractionCache:
+  if args.no_cache:
+    return None
+  return ExtractionCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+
+
+# Options that affect the output YAML and images, and the source files that do.
+STAMP_OPTIONS = ['input_pdf', 'existing_yaml', 'output_image_dir', 'first_page', 'last_page',
+                 'no_fuzzy_match']
+
+
+def stamp_from_args(args) -> Stamp:
+  if args.no_cache:
+    return None
+  options = {name: getattr(args, name) for name in STAMP_OPTIONS}
+  options['sources'] = sources_fingerprint()
+  return Stamp(args.output_yaml, options, args.cache_dir)
+
+
+def main(args):
+  # This runs before lxml, natsort, or yaml are imported, so a run with nothing to do exits almost immediately.
+  stamp = None if args.report else stamp_from_args(args)
+  if stamp and stamp.is_up_to_date():
+    print(f'{args.output_yaml} is up to date')
+    stamp.touch_outputs()
+    return
+
+  if args.timings or args.profile:
+    TIMER.enable(profile_path=args.profile)
+
+  qfile = extract_pdf_to_yaml(args.input_pdf, args.output_yaml, args.existing_yaml, args.output_image_dir,
+                      cache=cache_from_args(args), fuzzy_match=not args.no_fuzzy_match,
+                      first_page=args.first_page, last_page=args.last_page,
+                      tmp_dir=args.tmp_dir, page_jobs=args.page_jobs,
+                      reuse_cached_questions=not args.report)
+
+  if args.report:
+    write_report(args.report, {args.input_pdf: qfile.diagnostics + validate_bank(
+      qfile.questions, qfile.getFileID(), args.output_image_dir, qfile.positions)})
+
+  if stamp:
+    inputs = [args.input_pdf] + ([args.existing_yaml] if args.existing_yaml else [])
+    outputs = [args.output_yaml] + sorted({os.path.join(args.output_image_dir, quest.question_image)
+                                           for quest in qfile.questions if quest.question_image})
+    stamp.save(inputs, outputs)
+
+  if TIMER.enabled:
+    TIMER.write_report(args.timings)
 
 
 if __name__ == '__main__' and not hasattr(sys, 'ps1'):
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Batch version of generate_yaml_from_pdf.py: extracts many PDFs in parallel, one worker process per PDF.
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import sys
+import time
+
+from extraction_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from generate_yaml_from_pdf import QuestionFile, cache_from_args, extract_pdf_to_yaml
+
+parser = argparse.ArgumentParser(description='Convert several PDF files from thb.gov.tw into .yaml files in parallel')
+parser.add_argument('--input-pdfs', nargs='+', required=True, help='PDF files, or directories containing PDF files, to extract')
+parser.add_argument('--output-yaml-dir', required=True,
+                    help='Directory to write output YAML files to. Each file is named after QuestionFile.getFileID(). '
+                         'If a YAML file already exists there, difficulty ratings are copied from it.')
+parser.add_argument('--output-image-dir', help='Optional path to write output images to (only used for the signs PDFs)')
+parser.add_argument('--jobs', type=int, help='Number of worker processes (default: number of CPUs)')
+parser.add_argument('--tmp-dir', help='Directory to put temporary files in, e.g. /dev/shm to keep them in memory '
+                                      '(default: the system temporary directory)')
+parser.add_argument('--no-fuzzy-match', action='store_true',
+                    help='Only copy difficulty ratings from questions in the existing YAML files that match exactly')
+parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Directory to cache pdftohtml output and parsed questions in')
+parser.add_argument('--cache-max-mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                    help='Evict least-recently-used cache entries once the cache is bigger than this')
+parser.add_argument('--no-cache', action='store_true', help="Don't read or write the extraction cache")
+
+
+def expand_input_pdfs(input_pdfs: list) -> list:
+  ret = []
+  for path in input_pdfs:
+    if os.path.isdir(path):
+      ret.extend(sorted(glob.glob(os.path.join(path, '*.pdf'))))
+    else:
+      ret.append(path)
+  return ret
+
+
+def extract_one(input_pdf: str, output_yaml_dir: str, output_image_dir: str, cache, fuzzy_match: bool,
+                tmp_dir: str):
+  qfile = QuestionFile(filebase=os.path.splitext(os.path.basename(input_pdf))[0])
+  output_yaml = os.path.join(output_yaml_dir, qfile.getFileID() + '.yaml')
+  existing_yaml = output_yaml if os.path.exists(output_yaml) else None
+  if qfile.signsrules != 'signs':
+    output_image_dir = None
+
+  start = time.perf_counter()
+  extract_pdf_to_yaml(input_pdf, output_yaml, existing_yaml, output_image_dir, cache=cache, fuzzy_match=fuzzy_match,
+                      tmp_dir=tmp_dir, evict_cache=False)
+  return output_yaml, time.perf_counter() - start
+
+
+def main(args):
+  input_pdfs = expand_input_pdfs(args.input_pdfs)
+
+  os.makedirs(args.output_yaml_dir, exist_ok=True)
+  if args.output_image_dir:
+    os.makedirs(args.output_image_dir, exist_ok=True)
+
+  cache = cache_from_args(args)
+
+  start = time.perf_counter()
+  failed = False
+  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+    future_to_pdf = {
+      executor.submit(
+        extract_one, input_pdf, args.output_yaml_dir, args.output_image_dir, cache, not args.no_fuzzy_match,
+        args.tmp_dir): input_pdf
+      for input_pdf in input_pdfs
+    }
+    for future in concurrent.futures.as_completed(future_to_pdf):
+      input_pdf = future_to_pdf[future]
+      try:
+        output_yaml, elapsed = future.result()
+      except Exception as e:
+        print(f'FAILED {input_pdf}: {e!r}', file=sys.stderr)
+        failed = True
+        continue
+      print(f'{elapsed:7.2f}s  {input_pdf} -> {output_yaml}')
+
+  # Evict once all the workers are done, so that none of them loses cache entries it's still using.
+  if cache:
+    cache.evict()
+
+  print(f'{time.perf_counter() - start:7.2f}s  total for {len(input_pdfs)} PDFs')
+
+  if failed:
+    sys.exit(1)
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
@@ -0,0 +1,79 @@
+"""
+Shrinks the images that go into .apkg files.
+
+Images are either recompressed as PNG (losslessly) or converted to WebP, and optionally downscaled. Each result is
+cached under the SHA-256 of the source image and the settings used, so every image is only processed once. This needs
+Pillow, which is only imported when an image actually has to be processed.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import shutil
+from typing import Dict, Iterable, List
+
+FORMATS = {'png': 'PNG', 'webp': 'WEBP'}
+WEBP_QUALITY = 85
+
+
+def _sha256_file(path: str) -> str:
+  sha256 = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 16), b''):
+      sha256.update(chunk)
+  return sha256.hexdigest()
+
+
+def _optimize_one(src_path: str, cache_dir: str, fmt: str, max_dimension: int) -> str:
+  settings = f'{fmt}-{max_dimension or "full"}'
+  dest_path = os.path.join(cache_dir, settings, f'{_sha256_file(src_path)[:16]}.{fmt}')
+  if os.path.exists(dest_path):
+    return dest_path
+
+  from PIL import Image
+
+  os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+  tmp_path = f'{dest_path}.{os.getpid()}.tmp'
+  with Image.open(src_path) as image:
+    resized = False
+    if max_dimension and max(image.size) > max_dimension:
+      image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+      resized = True
+
+    if fmt == 'webp':
+      if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+      image.save(tmp_path, FORMATS[fmt], quality=WEBP_QUALITY, method=6)
+    else:
+      image.save(tmp_path, FORMATS[fmt], optimize=True)
+
+  # Recompressing a PNG that was already well compressed can make it bigger. In that case keep the original.
+  if fmt == 'png' and not resized and os.path.getsize(tmp_path) >= os.path.getsize(src_path):
+    shutil.copy(src_path, tmp_path)
+
+  os.replace(tmp_path, dest_path)
+  return dest_path
+
+
+def optimize_images(src_paths: Iterable[str], cache_dir: str, fmt: str = 'png', max_dimension: int = None,
+                    jobs: int = None) -> Dict[str, str]:
+  """
+  Optimize each image in `src_paths` across a pool of worker processes. Returns a dict mapping each source path to
+  the path of its optimized version in `cache_dir`.
+  """
+  if fmt not in FORMATS:
+    raise ValueError(f'Unknown image format {repr(fmt)}')
+
+  src_paths = list(src_paths)
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+    dest_paths = executor.map(
+      _optimize_one, src_paths, [cache_dir] * len(src_paths), [fmt] * len(src_paths), [max_dimension] * len(src_paths))
+    return dict(zip(src_paths, dest_paths))
+
+
+def report_savings(name: str, src_paths: List[str], image_map: Dict[str, str]) -> None:
+  before = sum(os.path.getsize(path) for path in src_paths)
+  after = sum(os.path.getsize(image_map[path]) for path in src_paths)
+  saved = before - after
+  percent = 100 * saved / before if before else 0
+  print(f'{name}: images {before:,} -> {after:,} bytes ({saved:,} bytes / {percent:.0f}% saved)')
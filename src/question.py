@@ -1,14 +1,100 @@
 from copy import deepcopy
 import functools
+import hashlib
 import inspect
-import yaml
+import re
+
+from typing import Callable, List
+
+
+@functools.lru_cache(maxsize=None)
+def _yaml():
+  """
+  Return a (yaml module, loader, fast dumper) tuple. The fast dumper is None if PyYAML wasn't built with LibYAML.
+
+  PyYAML takes a noticeable fraction of the scripts' startup time to import, so it's only imported once a YAML file is
+  actually read or written.
+  """
+  import yaml
+  # Use the LibYAML bindings when PyYAML was built with them. They're much faster than the pure-Python implementation.
+  try:
+    return yaml, yaml.CSafeLoader, yaml.CSafeDumper
+  except AttributeError:
+    return yaml, yaml.SafeLoader, None
+
+
+def load_yaml(stream):
+  """Equivalent to yaml.safe_load(stream)."""
+  yaml, loader, _ = _yaml()
+  return yaml.load(stream, Loader=loader)
+
+
+def dump_yaml(data, stream=None, allow_unicode: bool = False):
+  """
+  Equivalent to yaml.dump(data, stream, sort_keys=False, allow_unicode=allow_unicode), and produces byte-identical
+  output.
+
+  LibYAML's emitter folds long double-quoted strings differently than PyYAML's, so when `data` is a list (like our
+  question lists) each entry is emitted with LibYAML, and only entries that come out containing a double quote are
+  re-emitted with the pure-Python dumper.
+  """
+  yaml, _, fast_dumper = _yaml()
+  if fast_dumper is None or not isinstance(data, list) or not data:
+    return yaml.dump(data, stream, sort_keys=False, allow_unicode=allow_unicode)
+
+  pieces = []
+  for entry in data:
+    piece = yaml.dump([entry], Dumper=fast_dumper, sort_keys=False, allow_unicode=allow_unicode)
+    if '"' in piece:
+      piece = yaml.dump([entry], sort_keys=False, allow_unicode=allow_unicode)
+    pieces.append(piece)
+
+  ret = ''.join(pieces)
+  if stream is None:
+    return ret
+  stream.write(ret)
+
+
+# Answers of multiple choice questions, and the markers that separate their choices in normalized question text.
+CHOICE_ANSWERS = frozenset(['1', '2', '3'])
+CHOICE_MARKER_RE = re.compile(r'\([1-3]\)')
+
+# A run of spaces, <br/> tags, and (1)/(2)/(3) choice markers that normalize_question_text has to rewrite. Single
+# spaces between words don't match, so most of the text is skipped without calling back into Python.
+_NORMALIZE_RUN_RE = re.compile(r' *(?:(?:<br/>|\( *[123] *\)) *)+| {2,}')
+_CHOICE_MARKER_RE = re.compile(r'\( *([123]) *\)')
+# Matches if there's anything for _NORMALIZE_RUN_RE to rewrite, i.e. anything other than '(1)' markers with single
+# spaces around them. Text that is already normalized is only scanned by this, which doesn't call back into Python.
+_NEEDS_NORMALIZING_RE = re.compile(r'<br/>| {2,}|\( +[123]|[123] +\)|[^ ]\([123]\)|\([123]\)[^ ]')
+
 
-from typing import List
+def _normalize_run(m) -> str:
+  choices = _CHOICE_MARKER_RE.findall(m.group())
+  if not choices:
+    return ' '
+  return ' (' + ') ('.join(choices) + ') '
+
+
+def normalize_question_text(question: str) -> str:
+  """
+  Put single spaces around choice markers like '( 1 )' (rewritten as '(1)'), replace <br/> tags with spaces, collapse
+  runs of spaces, and strip the result, all in one regex pass.
+  """
+  if _NEEDS_NORMALIZING_RE.search(question) is None:
+    return question.strip()
+  return _NORMALIZE_RUN_RE.sub(_normalize_run, question).strip()
 
 
 class Question(object):
   UNKNOWN_DIFFICULTY = 'unknown_difficulty'
 
+  FIELDS = ('question', 'question_image', 'answer', 'number', 'category', 'difficulty', 'note')
+  _EMPTY_FIELDS = ('', None, '', '', '', UNKNOWN_DIFFICULTY, '')
+
+  # _content_hash caches content_hash() as a (fields, digest) tuple, and _normalized_question caches
+  # normalized_question() as a (question, normalized) tuple. They're only reused while the fields are unchanged.
+  __slots__ = FIELDS + ('_content_hash', '_normalized_question')
+
   def __init__(self, question='', question_image=None, answer='', number='', category='', difficulty=UNKNOWN_DIFFICULTY, note=''):
     self.question = question
     self.question_image = question_image
@@ -17,37 +103,97 @@ class Question(object):
     self.category = category
     self.difficulty = difficulty
     self.note = note
+    self._content_hash = None
+    self._normalized_question = None
+
+  def _fields(self) -> tuple:
+    return (self.question, self.question_image, self.answer, self.number, self.category, self.difficulty, self.note)
 
   def __repr__(self):
-    attrs = ['question', 'question_image', 'answer', 'number', 'category', 'difficulty', 'note']
     pieces = []
-    for attr in attrs:
+    for attr in self.FIELDS:
       pieces.append('{}={}'.format(attr, repr(getattr(self, attr))))
     return '{}({})'.format(self.__class__.__name__, ', '.join(pieces))
 
   def __eq__(self, other):
-    return self.__class__ is other.__class__ and self.__dict__ == other.__dict__
+    return self.__class__ is other.__class__ and self._fields() == other._fields()
 
   def __ne__(self, other):
     return not (self == other)
 
+  def __hash__(self):
+    # Strings cache their own hashes, so this is cheap even for long question text.
+    return hash(self._fields())
+
+  def content_hash(self) -> str:
+    """
+    Hex digest of the question's fields. Unlike hash(), this is the same in every process, so it can be persisted.
+    """
+    fields = self._fields()
+    if self._content_hash is None or self._content_hash[0] != fields:
+      self._content_hash = (fields, hashlib.blake2b(repr(fields).encode('utf-8'), digest_size=16).hexdigest())
+    return self._content_hash[1]
+
+  def normalized_question(self) -> str:
+    """normalize_question_text(self.question), computed once for each question text."""
+    if self._normalized_question is None or self._normalized_question[0] != self.question:
+      self._normalized_question = (self.question, normalize_question_text(self.question))
+    return self._normalized_question[1]
+
+  @staticmethod
+  def normalize_list(qlist: List['Question'], fixup: Callable[[str], str] = None) -> None:
+    """
+    Replace the text of each question in `qlist` with its normalized text, passed through `fixup` if given. Each
+    question's normalized text is cached, so a later normalized_question() call is free.
+    """
+    for quest in qlist:
+      normalized = normalize_question_text(quest.question)
+      # Normalizing normalized text doesn't change it, unless removing a <br/> tag created a new choice marker (as in
+      # '(<br/>1)').
+      idempotent = '<br/>' not in quest.question
+      quest.question = fixup(normalized) if fixup else normalized
+      if idempotent and quest.question == normalized:
+        quest._normalized_question = (normalized, normalized)
+
   def __bool__(self):
-    empty = Question()
-    return self != empty
+    return self._fields() != self._EMPTY_FIELDS
 
-  def to_dict(self):
-    ret = dict(self.__dict__)
+  def __getstate__(self):
+    return self._fields()
+
+  def __setstate__(self, state):
+    for name, value in zip(self.FIELDS, state):
+      setattr(self, name, value)
+    self._content_hash = None
+    self._normalized_question = None
 
-    for key in list(ret):
-      if not ret[key]:
-        del ret[key]
+  def to_dict(self):
+    ret = {}
+    for name, value in zip(self.FIELDS, self._fields()):
+      if value:
+        ret[name] = value
 
     return ret
 
   @classmethod
-  def load_list_from_yaml(cls, path_to_yaml: str) -> List['Question']:
-    with open(path_to_yaml) as f:
-      data = yaml.safe_load(f)
+  def load_list_from_yaml(cls, path_to_yaml: str, prefer_binary: bool = True) -> List['Question']:
+    """
+    Load questions from `path_to_yaml`.
+
+    If `prefer_binary` is set and there's a question store file (see question_store.py) next to the YAML file that was
+    written from its current contents, the questions are loaded from that instead. Hashing the YAML file to check is
+    much cheaper than parsing it.
+    """
+    with open(path_to_yaml, 'rb') as f:
+      yaml_bytes = f.read()
+
+    if prefer_binary:
+      import question_store
+      stored = question_store.load_if_current(question_store.store_path_for_yaml(path_to_yaml), yaml_bytes)
+      if stored is not None:
+        return stored
+
+    data = load_yaml(yaml_bytes)
 
     ret = []
     for entry in data:
@@ -70,4 +216,4 @@ class Question(object):
       data.append(entry.to_dict())
 
     with open(path_to_yaml, 'w') as f:
-      yaml.dump(data, f, sort_keys=False)
+      dump_yaml(data, f)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Compact, memory-mappable binary format for question lists, as an alternative to YAML for tools that load the whole
+question bank over and over.
+
+Layout (all integers are little-endian uint32):
+
+  header:        magic b'TWQS', version, number of questions N, number of strings S, SHA-256 of the source YAML file
+  columns:       N values each for number, category, answer, difficulty, question, question_image, note
+  string index:  S + 1 offsets into the string data
+  string data:   UTF-8 bytes of every distinct string
+
+The number column holds the question number itself; every other column holds an index into the string table. NONE
+means the field is empty (number == '' or question_image is None). The SHA-256 of the YAML file is used to tell
+whether the store is still up to date with it.
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import List, Optional
+
+from question import Question
+
+MAGIC = b'TWQS'
+VERSION = 2
+NONE = 0xFFFFFFFF
+
+HEADER = struct.Struct('<4sIII32s')
+COLUMNS = ['number', 'category', 'answer', 'difficulty', 'question', 'question_image', 'note']
+
+parser = argparse.ArgumentParser(description='Export YAML question lists to the binary question store format')
+parser.add_argument('--yamls', nargs='+', required=True,
+                    help='YAML files to export. Each one is written next to the YAML file with a .qstore extension.')
+
+
+def store_path_for_yaml(path_to_yaml: str) -> str:
+  return os.path.splitext(path_to_yaml)[0] + '.qstore'
+
+
+def _uint32_array(values) -> array:
+  ret = array('I', values)
+  if sys.byteorder != 'little':
+    ret.byteswap()
+  return ret
+
+
+def write_question_store(qlist: List[Question], path: str, yaml_sha256: bytes = bytes(32)) -> None:
+  strings = []
+  string_to_id = {}
+
+  def string_id(value):
+    if value is None:
+      return NONE
+    if value not in string_to_id:
+      string_to_id[value] = len(strings)
+      strings.append(value)
+    return string_to_id[value]
+
+  columns = {name: [] for name in COLUMNS}
+  for quest in qlist:
+    columns['number'].append(NONE if quest.number == '' else int(quest.number))
+    for name in COLUMNS[1:]:
+      columns[name].append(string_id(getattr(quest, name)))
+
+  encoded = [s.encode('utf-8') for s in strings]
+  offsets = [0]
+  for data in encoded:
+    offsets.append(offsets[-1] + len(data))
+
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, VERSION, len(qlist), len(strings), yaml_sha256))
+    for name in COLUMNS:
+      f.write(_uint32_array(columns[name]).tobytes())
+    f.write(_uint32_array(offsets).tobytes())
+    f.write(b''.join(encoded))
+  os.replace(tmp_path, path)
+
+
+class QuestionView:
+  """Read-only view of one question in a QuestionStore. Fields are decoded from the mapped file when accessed."""
+  __slots__ = ['_store', '_index']
+
+  def __init__(self, store: 'QuestionStore', index: int):
+    self._store = store
+    self._index = index
+
+  @property
+  def number(self):
+    value = self._store._columns['number'][self._index]
+    return '' if value == NONE else value
+
+  @property
+  def category(self) -> str:
+    return self._store._string(self._store._columns['category'][self._index])
+
+  @property
+  def answer(self) -> str:
+    return self._store._string(self._store._columns['answer'][self._index])
+
+  @property
+  def difficulty(self) -> str:
+    return self._store._string(self._store._columns['difficulty'][self._index])
+
+  @property
+  def question(self) -> str:
+    return self._store._string(self._store._columns['question'][self._index])
+
+  @property
+  def question_image(self):
+    return self._store._string(self._store._columns['question_image'][self._index])
+
+  @property
+  def note(self) -> str:
+    return self._store._string(self._store._columns['note'][self._index])
+
+  def to_question(self) -> Question:
+    return Question(**{name: getattr(self, name) for name in COLUMNS})
+
+  def __repr__(self):
+    return f'{self.__class__.__name__}({self.to_question()!r})'
+
+
+class QuestionStore:
+  """
+  A memory-mapped question store file. Behaves as a read-only sequence of QuestionView objects.
+
+  The columns are memoryviews into the mapping, so opening a store doesn't copy or decode anything.
+  """
+  def __init__(self, path: str):
+    with open(path, 'rb') as f:
+      if os.fstat(f.fileno()).st_size < HEADER.size:
+        raise ValueError(f'{path} is too short to be a question store')
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, self._count, num_strings, self.yaml_sha256 = HEADER.unpack_from(self._mmap)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError(f'{path} is not a version {VERSION} question store')
+    # A truncated file (e.g. from an interrupted copy) can't hold the columns and string index its header promises.
+    if len(self._mmap) < HEADER.size + 4 * (len(COLUMNS) * self._count + num_strings + 1):
+      raise ValueError(f'{path} is truncated')
+
+    buf = memoryview(self._mmap)
+    pos = HEADER.size
+    self._columns = {}
+    for name in COLUMNS:
+      self._columns[name] = self._uint32_view(buf[pos:pos + 4 * self._count])
+      pos += 4 * self._count
+    self._offsets = self._uint32_view(buf[pos:pos + 4 * (num_strings + 1)])
+    pos += 4 * (num_strings + 1)
+    self._data = buf[pos:]
+    if self._offsets[num_strings] != len(self._data):
+      raise ValueError(f'{path} is truncated')
+
+  @staticmethod
+  def _uint32_view(buf: memoryview):
+    if sys.byteorder == 'little':
+      return buf.cast('I')
+    # Big-endian hosts can't use the file's columns in place.
+    ret = array('I')
+    ret.frombytes(buf)
+    ret.byteswap()
+    return ret
+
+  def _string(self, string_id: int):
+    if string_id == NONE:
+      return None
+    return str(self._data[self._offsets[string_id]:self._offsets[string_id + 1]], 'utf-8')
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, index: int) -> QuestionView:
+    if index < 0:
+      index += self._count
+    if not 0 <= index < self._count:
+      raise IndexError(index)
+    return QuestionView(self, index)
+
+  def __iter__(self):
+    for index in range(self._count):
+      yield QuestionView(self, index)
+
+  def to_questions(self) -> List[Question]:
+    return [view.to_question() for view in self]
+
+
+def load_if_current(store_path: str, yaml_bytes: bytes) -> Optional[List[Question]]:
+  """
+  Return the questions in the store at `store_path` if it was written from a YAML file with the contents `yaml_bytes`,
+  and None if it wasn't, or doesn't exist, or is in an older format or corrupt.
+  """
+  if not os.path.exists(store_path):
+    return None
+  try:
+    store = QuestionStore(store_path)
+    if store.yaml_sha256 != hashlib.sha256(yaml_bytes).digest():
+      return None
+    return store.to_questions()
+  except (ValueError, TypeError, struct.error, IndexError, UnicodeDecodeError):
+    return None
+
+
+def main(args):
+  for path_to_yaml in args.yamls:
+    with open(path_to_yaml, 'rb') as f:
+      yaml_sha256 = hashlib.sha256(f.read()).digest()
+    qlist = Question.load_list_from_yaml(path_to_yaml, prefer_binary=False)
+    write_question_store(qlist, store_path_for_yaml(path_to_yaml), yaml_sha256)
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
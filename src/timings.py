@@ -0,0 +1,169 @@
+"""
+Per-stage wall time and memory measurements for the build scripts (see their --timings and --profile options).
+
+Stages nest: while a stage is running, time spent in a stage entered from it is only counted towards the inner stage.
+This makes it possible to separate interleaved work, like pdftohtml producing XML while it's being parsed. Memory is
+measured with the process's peak RSS (plus the peak RSS of child processes, for pdftohtml), which is cheap enough not to
+distort the timings.
+
+When timings are disabled, `stage` returns a shared no-op context manager and `wrap_iter`/`wrap_reader` return their
+argument unchanged, so the instrumentation costs nothing.
+"""
+
+import contextlib
+import cProfile
+import json
+import sys
+import time
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows.
+  resource = None
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+def _max_rss_kb(who) -> int:
+  if resource is None:
+    return None
+  # ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+  max_rss = resource.getrusage(who).ru_maxrss
+  return max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+
+class StageTimer:
+  def __init__(self):
+    self.enabled = False
+    self.profile_path = None
+    self._profiler = None
+    self._stages = {}
+    self._stack = []
+    self._last_switch = None
+    self._last_rss = None
+    self._start = None
+
+  def enable(self, profile_path: str = None) -> None:
+    self.enabled = True
+    self.profile_path = profile_path
+    self._start = time.perf_counter()
+
+  def _switch(self) -> None:
+    # Charge the time since the last push/pop to the stage on top of the stack.
+    now = time.perf_counter()
+    if self._stack:
+      record = self._stages[self._stack[-1]]
+      record['wall_s'] += now - self._last_switch
+      rss = _max_rss_kb(resource.RUSAGE_SELF) if resource else None
+      if rss is not None:
+        record['rss_growth_kb'] += rss - self._last_rss
+        record['peak_rss_kb'] = max(record['peak_rss_kb'], rss)
+        self._last_rss = rss
+    else:
+      self._last_rss = _max_rss_kb(resource.RUSAGE_SELF) if resource else None
+    self._last_switch = now
+
+  def _push(self, name: str) -> None:
+    self._switch()
+    if name not in self._stages:
+      self._stages[name] = {'calls': 0, 'wall_s': 0.0, 'rss_growth_kb': 0, 'peak_rss_kb': 0}
+    self._stages[name]['calls'] += 1
+    self._stack.append(name)
+
+  def _pop(self) -> None:
+    self._switch()
+    self._stack.pop()
+
+  @contextlib.contextmanager
+  def _stage(self, name: str):
+    self._push(name)
+    try:
+      yield
+    finally:
+      self._pop()
+
+  def stage(self, name: str):
+    """Context manager that counts the time spent inside it towards stage `name`."""
+    if not self.enabled:
+      return _NULL_CONTEXT
+    return self._stage(name)
+
+  def wrap_iter(self, name: str, iterable):
+    """Count the time spent producing each item of `iterable` towards stage `name`."""
+    if not self.enabled:
+      return iterable
+    return self._wrap_iter(name, iterable)
+
+  def _wrap_iter(self, name: str, iterable):
+    it = iter(iterable)
+    while True:
+      self._push(name)
+      try:
+        item = next(it)
+      except StopIteration:
+        return
+      finally:
+        self._pop()
+      yield item
+
+  def wrap_reader(self, name: str, stream):
+    """Count the time spent in stream.read() towards stage `name`."""
+    if not self.enabled:
+      return stream
+    return _TimedReader(self, name, stream)
+
+  def profile(self):
+    """Context manager that runs the code inside it under cProfile, if a profile path was given to enable()."""
+    if not self.enabled or not self.profile_path:
+      return _NULL_CONTEXT
+    return self._profile()
+
+  @contextlib.contextmanager
+  def _profile(self):
+    if self._profiler is None:
+      self._profiler = cProfile.Profile()
+    self._profiler.enable()
+    try:
+      yield
+    finally:
+      self._profiler.disable()
+
+  def report(self) -> dict:
+    return {
+      'argv': sys.argv,
+      'total_wall_s': time.perf_counter() - self._start,
+      'peak_rss_kb': _max_rss_kb(resource.RUSAGE_SELF) if resource else None,
+      'peak_child_rss_kb': _max_rss_kb(resource.RUSAGE_CHILDREN) if resource else None,
+      'stages': self._stages,
+    }
+
+  def write_report(self, path: str) -> None:
+    """
+    Write the report as JSON to `path` ('-' for stdout, None for nowhere), and the cProfile stats to the profile path,
+    if any.
+    """
+    if path == '-':
+      json.dump(self.report(), sys.stdout, indent=2)
+      print()
+    elif path:
+      with open(path, 'w') as f:
+        json.dump(self.report(), f, indent=2)
+
+    if self._profiler is not None:
+      self._profiler.dump_stats(self.profile_path)
+
+
+class _TimedReader:
+  def __init__(self, timer: StageTimer, name: str, stream):
+    self._timer = timer
+    self._name = name
+    self._stream = stream
+
+  def read(self, size=-1):
+    with self._timer.stage(self._name):
+      return self._stream.read(size)
+
+
+# Shared by all modules in a process.
+TIMER = StageTimer()
@@ -0,0 +1,83 @@
+"""
+Lets the build scripts exit early when their outputs are already up to date, before they import anything heavy.
+
+After a successful run, a script saves a stamp recording the options it was run with (including a fingerprint of every
+module in src/, see sources_fingerprint) and the size, mtime, and SHA-256 of every file it read or wrote. On the next run, the outputs are up to date if
+the options are the same and none of those files changed. Files whose size and mtime haven't changed aren't hashed
+again, so the check is only a handful of stat() calls.
+
+Stamps live in the cache directory, keyed by the path of the script's main output, so that they don't clutter the
+(checked-in) output directories.
+"""
+
+import glob
+import hashlib
+import json
+import os
+from typing import List
+
+from extraction_cache import DEFAULT_CACHE_DIR, source_fingerprint
+
+
+def sources_fingerprint() -> str:
+  """
+  Hash every module in src/. A script's output can depend on any module it imports, directly or not, and a hand-kept
+  list of them goes stale, so this errs on the side of rebuilding (like the Makefile's src/*.py prerequisites).
+  """
+  src_dir = os.path.dirname(os.path.abspath(__file__))
+  return source_fingerprint(sorted(os.path.basename(path) for path in glob.glob(os.path.join(src_dir, '*.py'))))
+
+
+class Stamp:
+  def __init__(self, output_path: str, options: dict, cache_dir: str = DEFAULT_CACHE_DIR):
+    key = hashlib.sha256(os.path.abspath(output_path).encode('utf-8')).hexdigest()[:16]
+    self.path = os.path.join(cache_dir, 'stamps', key + '.json')
+    self.options = options
+
+    self._old = {}
+    if os.path.exists(self.path):
+      with open(self.path) as f:
+        self._old = json.load(f)
+
+  def _file_entry(self, path: str) -> dict:
+    st = os.stat(path)
+    old_entry = self._old.get('files', {}).get(path)
+    if old_entry and old_entry['size'] == st.st_size and old_entry['mtime_ns'] == st.st_mtime_ns:
+      return old_entry
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 16), b''):
+        sha256.update(chunk)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha256.hexdigest()}
+
+  def is_up_to_date(self) -> bool:
+    if not self._old.get('files') or self._old.get('options') != self.options:
+      return False
+
+    for path, old_entry in self._old['files'].items():
+      if not os.path.exists(path) or self._file_entry(path)['sha256'] != old_entry['sha256']:
+        return False
+    return True
+
+  def touch_outputs(self) -> None:
+    """Bump the mtimes of the recorded outputs, so that make also considers them up to date."""
+    for path in self._old['outputs']:
+      os.utime(path)
+    self.save(self._old['inputs'], self._old['outputs'])
+
+  def save(self, inputs: List[str], outputs: List[str]) -> None:
+    stamp = {
+      'options': self.options,
+      'inputs': inputs,
+      'outputs': outputs,
+      'files': {path: self._file_entry(path) for path in [*inputs, *outputs]},
+    }
+
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    # Several builds may run at once (e.g. make -j), so write to a temporary file and rename it into place.
+    tmp_path = f'{self.path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump(stamp, f)
+    os.replace(tmp_path, self.path)
+    self._old = stamp
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Checks question banks for problems, and reports all of them at once in a machine-readable form.
+
+Each problem is an Anomaly, with one of these kinds. The parser in generate_yaml_from_pdf.py records the first three
+while reading a PDF, and validate_bank checks a whole parsed bank for the rest in one pass:
+
+  answer_overwritten   a second answer was found for a question
+  answer_not_found     the text after a question number isn't an answer
+  image_count_mismatch pdftohtml extracted a different number of images than there are questions
+  missing_question     the question has no text
+  missing_answer       the question has no answer
+  invalid_answer       the answer isn't one of 1/2/3 (multiple choice banks) or O/X (true or false banks)
+  bad_choice_split     a multiple choice question doesn't split into exactly three choices
+  missing_number       the question has no number
+  duplicate_number     another question in the bank has the same number
+  numbering_gap        some numbers are missing between 1 and the highest number in the bank
+  missing_image        a question in a signs bank has no image
+  unexpected_image     a question in a rules bank has an image
+  missing_image_file   the question's image isn't in the image directory
+
+When the questions come straight from parsing a PDF, anomalies carry the page and position of the question in the PDF.
+
+Run as a script, this checks every YAML file in yamls/ (fast enough for a pre-commit hook) and/or the given PDFs, and
+exits with status 1 if it finds any anomalies that aren't in the baseline. The baseline is a report of known anomalies
+(like questions that are missing from the PDFs themselves), written with --report.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from question import CHOICE_ANSWERS, CHOICE_MARKER_RE, Question
+
+# realpath, so that this also works when symlinked as a git hook.
+REPO_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+BASELINE_PATH = os.path.join(REPO_DIR, 'yamls', '.validation-baseline.json')
+
+# Questions with these anomalies can't be turned into notes (see generate_anki_from_yaml.py --skip-invalid).
+UNBUILDABLE_KINDS = frozenset(['missing_question', 'missing_answer', 'invalid_answer', 'bad_choice_split'])
+
+ANSWERS_BY_FORMAT = {'choice': CHOICE_ANSWERS, 'true': frozenset(['O', 'X'])}
+
+parser = argparse.ArgumentParser(description='Check question banks for problems')
+parser.add_argument('--yamls', nargs='*', help='YAML files to check (default: every file in yamls/, unless --pdfs is given)')
+parser.add_argument('--pdfs', nargs='+', default=[],
+                    help='PDFs to parse and check. Anomalies found this way include their position in the PDF.')
+parser.add_argument('--image-dir', default=os.path.join(REPO_DIR, 'images'),
+                    help='Directory that the YAML files\' images should be in')
+parser.add_argument('--report', metavar='PATH', help="Write the anomalies as JSON to PATH ('-' for stdout)")
+parser.add_argument('--ignore', nargs='+', default=[], metavar='KIND', help='Kinds of anomalies to ignore')
+parser.add_argument('--baseline', default=BASELINE_PATH,
+                    help="Report of known anomalies to ignore, as written by --report ('' to ignore none)")
+
+
+class Anomaly(NamedTuple):
+  """
+  A problem with the question numbered `number`, or with the whole bank if `number` is None.
+
+  `page` is the PDF page the problem was found on, and `top` and `left` are the position on that page, relative to its
+  height and width. They're None when the position isn't known (e.g. when the questions were loaded from YAML).
+  """
+  kind: str
+  number: Optional[int]
+  message: str
+  page: Optional[int] = None
+  top: Optional[float] = None
+  left: Optional[float] = None
+
+
+def bank_format(file_id: str) -> Tuple[Optional[str], Optional[str]]:
+  """
+  Return the (signsrules, truechoice) attributes of a bank from its file ID (like 'english-car-rules-true'), or
+  (None, None) if the file ID doesn't look like one.
+  """
+  pieces = file_id.split('-')
+  if len(pieces) != 4:
+    return None, None
+  return pieces[2], pieces[3]
+
+
+def question_anomalies(quest: Question, signsrules: str = None, truechoice: str = None) -> List[Tuple[str, str]]:
+  """Return a (kind, message) tuple for each problem with `quest` on its own."""
+  ret = []
+  if not quest.question.strip():
+    ret.append(('missing_question', 'question has no text'))
+
+  if quest.answer == '':
+    ret.append(('missing_answer', 'question has no answer'))
+  elif truechoice in ANSWERS_BY_FORMAT and quest.answer not in ANSWERS_BY_FORMAT[truechoice]:
+    ret.append(('invalid_answer', f'answer {quest.answer!r} is not valid in a {truechoice!r} bank'))
+
+  if truechoice == 'choice' or quest.answer in CHOICE_ANSWERS:
+    num_choices = len(CHOICE_MARKER_RE.split(quest.question)) - 1
+    if num_choices != 3:
+      ret.append(('bad_choice_split', f'question splits into {num_choices} choices instead of 3'))
+
+  if signsrules == 'signs' and not quest.question_image:
+    ret.append(('missing_image', 'question in a signs bank has no image'))
+  elif signsrules == 'rules' and quest.question_image:
+    ret.append(('unexpected_image', 'question in a rules bank has an image'))
+
+  return ret
+
+
+def validate_bank(questions: List[Question], file_id: str = '', image_dir: str = None,
+                  positions: Dict[int, Tuple[int, float, float]] = None) -> List[Anomaly]:
+  """
+  Check the bank `questions` (whose file ID is `file_id`) and return its anomalies, ordered by question.
+
+  If `image_dir` is given, every image must exist in it. `positions` maps question numbers to the (page, top, left)
+  position of each question in the PDF, as recorded in QuestionFile.positions.
+  """
+  signsrules, truechoice = bank_format(file_id)
+  positions = positions or {}
+  ret = []
+  seen_numbers = set()
+
+  for quest in questions:
+    position = positions.get(quest.number, ())
+
+    kinds_and_messages = question_anomalies(quest, signsrules, truechoice)
+    if quest.number == '':
+      kinds_and_messages.append(('missing_number', 'question has no number'))
+    elif quest.number in seen_numbers:
+      kinds_and_messages.append(('duplicate_number', f'number {quest.number} is used more than once'))
+    else:
+      seen_numbers.add(quest.number)
+    if image_dir and quest.question_image and not os.path.exists(os.path.join(image_dir, quest.question_image)):
+      kinds_and_messages.append(('missing_image_file', f'{quest.question_image} is not in {image_dir}'))
+
+    ret.extend(Anomaly(kind, quest.number or None, message, *position) for kind, message in kinds_and_messages)
+
+  numbers = sorted(number for number in seen_numbers if isinstance(number, int))
+  prev = 0
+  for number in numbers:
+    if number > prev + 1:
+      if number == prev + 2:
+        message = f'question {prev + 1} is missing'
+      else:
+        message = f'questions {prev + 1}-{number - 1} are missing'
+      ret.append(Anomaly('numbering_gap', prev + 1, message))
+    prev = number
+
+  return ret
+
+
+def report_json(anomalies_by_source: Dict[str, List[Anomaly]]) -> dict:
+  counts = {}
+  for anomalies in anomalies_by_source.values():
+    for anomaly in anomalies:
+      counts[anomaly.kind] = counts.get(anomaly.kind, 0) + 1
+
+  return {
+    'counts': counts,
+    'sources': {source: [anomaly._asdict() for anomaly in anomalies]
+                for source, anomalies in anomalies_by_source.items()},
+  }
+
+
+def write_report(path: str, anomalies_by_source: Dict[str, List[Anomaly]]) -> None:
+  """Write the anomalies of each source file as JSON to `path`, or to stdout if `path` is '-'."""
+  text = json.dumps(report_json(anomalies_by_source), indent=1, ensure_ascii=False)
+  if path == '-':
+    print(text)
+  else:
+    with open(path, 'w') as f:
+      f.write(text + '\n')
+
+
+def _baseline_key(source: str, anomaly: Anomaly) -> tuple:
+  # Sources are compared by file name, so that the baseline works from any directory.
+  return os.path.basename(source), anomaly.kind, anomaly.number, anomaly.message
+
+
+def load_baseline(path: str) -> set:
+  if not path or not os.path.exists(path):
+    return set()
+  with open(path) as f:
+    report = json.load(f)
+  return {_baseline_key(source, Anomaly(**anomaly))
+          for source, anomalies in report['sources'].items() for anomaly in anomalies}
+
+
+def validate_pdf(path_to_pdf: str) -> List[Anomaly]:
+  from generate_yaml_from_pdf import QuestionFile, parse_pdf
+
+  filebase = os.path.splitext(os.path.basename(path_to_pdf))[0]
+  has_images = QuestionFile(filebase=filebase).signsrules == 'signs'
+  qfile = parse_pdf(path_to_pdf, has_images=has_images, strict=False)
+  return qfile.diagnostics + validate_bank(qfile.questions, qfile.getFileID(), positions=qfile.positions)
+
+
+def main(args):
+  yaml_paths = args.yamls
+  if yaml_paths is None and not args.pdfs:
+    yaml_paths = sorted(os.path.relpath(path) for path in glob.glob(os.path.join(REPO_DIR, 'yamls', '*.yaml')))
+
+  anomalies_by_source = {}
+  for yaml_path in yaml_paths or []:
+    file_id = os.path.splitext(os.path.basename(yaml_path))[0]
+    anomalies_by_source[yaml_path] = validate_bank(Question.load_list_from_yaml(yaml_path), file_id, args.image_dir)
+  for path_to_pdf in args.pdfs:
+    anomalies_by_source[path_to_pdf] = validate_pdf(path_to_pdf)
+
+  ignore = set(args.ignore)
+  known = load_baseline(args.baseline)
+  anomalies_by_source = {
+    source: [anomaly for anomaly in anomalies
+             if anomaly.kind not in ignore and _baseline_key(source, anomaly) not in known]
+    for source, anomalies in anomalies_by_source.items()}
+
+  if args.report:
+    write_report(args.report, anomalies_by_source)
+
+  total = 0
+  for source, anomalies in anomalies_by_source.items():
+    for anomaly in anomalies:
+      where = f' (page {anomaly.page})' if anomaly.page is not None else ''
+      number = f'question {anomaly.number}' if anomaly.number is not None else 'bank'
+      print(f'{source}: {number}{where}: {anomaly.kind}: {anomaly.message}', file=sys.stderr)
+    total += len(anomalies)
+
+  if total:
+    num_sources = sum(1 for anomalies in anomalies_by_source.values() if anomalies)
+    print(f'{total} anomalies in {num_sources} of {len(anomalies_by_source)} files', file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# Checks that parse_pdf gives the same result when the PDF is split into page ranges that are extracted in parallel
+# (page_jobs > 1) as when it is extracted in one go. Images are compared by content, since their paths differ.
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+
+from generate_yaml_from_pdf import QuestionFile, parse_pdf, sha256_file
+
+parser = argparse.ArgumentParser(description='Compare serial and page-parallel parse_pdf output')
+parser.add_argument('--pdfs', nargs='+', help='PDFs to check (default: every PDF in pdfs/)')
+parser.add_argument('--page-jobs', type=int, nargs='+', default=[2, 3, 8], help='Numbers of page ranges to try')
+
+
+def parse_with_image_hashes(path_to_pdf: str, has_images: bool, page_jobs: int):
+  with tempfile.TemporaryDirectory() as work_dir:
+    qfile = parse_pdf(path_to_pdf, has_images=has_images, work_dir=work_dir, page_jobs=page_jobs)
+    for quest in qfile.questions:
+      if quest.question_image is not None:
+        quest.question_image = sha256_file(quest.question_image)
+  return qfile.questions
+
+
+def main(args):
+  pdfs = args.pdfs or sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'pdfs', '*.pdf')))
+
+  failed = False
+  for path_to_pdf in pdfs:
+    has_images = QuestionFile(filebase=os.path.splitext(os.path.basename(path_to_pdf))[0]).signsrules == 'signs'
+    expected = parse_with_image_hashes(path_to_pdf, has_images, page_jobs=1)
+    for page_jobs in args.page_jobs:
+      actual = parse_with_image_hashes(path_to_pdf, has_images, page_jobs=page_jobs)
+      if actual == expected:
+        print(f'OK       {path_to_pdf} with {page_jobs} page ranges ({len(actual)} questions)')
+      else:
+        print(f'MISMATCH {path_to_pdf} with {page_jobs} page ranges')
+        failed = True
+
+  if failed:
+    sys.exit(1)
+
+
+if __name__ == '__main__' and not hasattr(sys, 'ps1'):
+  main(parser.parse_args())